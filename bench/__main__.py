@@ -0,0 +1,248 @@
+#
+#
+#
+
+from argparse import ArgumentParser
+from json import dumps
+from multiprocessing import Pipe, Process
+from os import sysconf
+from resource import RUSAGE_SELF, getrusage
+from statistics import mean, median
+from struct import unpack_from
+from threading import Event, Thread
+from time import perf_counter, sleep, time
+
+from requests import get
+from waitress import create_server
+
+from youtube_proxy import create_app
+from youtube_proxy.youtube import YouTube
+
+from .fmp4 import FRAME_HEADER
+from .origin import FakeOrigin
+
+
+class _StubStream:
+    # what pytube's Stream gives us that we actually use
+    def __init__(self, url):
+        self.url = url
+        self.itag = 140
+        self.abr = '128kbps'
+
+
+def stub_pytube(origin):
+    # resolve every video id to the fake origin rather than a watch page
+    def best_audio_stream(self):
+        return _StubStream(origin.url(self.id))
+
+    YouTube.best_audio_stream = best_audio_stream
+    # everything the origin serves is live
+    YouTube.is_live = True
+
+
+class _OriginUrls:
+    # what stub_pytube needs of FakeOrigin, in a form that can be handed to
+    # another process
+    def __init__(self, origin):
+        self.host = origin.host
+        self.port = origin.port
+
+    url = FakeOrigin.url
+
+
+def _rss():
+    # current resident set size in bytes, falling back to the peak where
+    # /proc isn't a thing
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _cpu():
+    usage = getrusage(RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _serve(origin, threads, conn):
+    # the proxy, in a process of its own so that what's measured is it and
+    # not the origin or the clients. sends its port, then (rss, cpu) whenever
+    # it's asked until it's told to stop
+    stub_pytube(origin)
+    app = create_app()
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+    Thread(target=server.run, name='waitress', daemon=True).start()
+    conn.send(server.effective_port)
+    while conn.recv():
+        conn.send((_rss(), _cpu()))
+    server.close()
+
+
+class Client(Thread):
+    # a listener, pulls ADTS off of the proxy and works out which segments it
+    # saw by way of the seq_num fmp4 stuffs in the front of every frame
+    def __init__(self, url, done):
+        super().__init__(name=f'Client[{url}]', daemon=True)
+        self.url = url
+        self.done = done
+
+        self.ttfb = None
+        self.bytes = 0
+        self.frames = 0
+        self.segments = []
+        self.error = None
+
+    def run(self):
+        start = perf_counter()
+        try:
+            with get(self.url, stream=True, timeout=60) as resp:
+                resp.raise_for_status()
+                buf = b''
+                for data in resp.iter_content(chunk_size=None):
+                    if self.ttfb is None:
+                        self.ttfb = perf_counter() - start
+                    self.bytes += len(data)
+                    buf = self._frames(buf + data)
+                    if self.done.is_set():
+                        break
+        except Exception as e:
+            self.error = e
+
+    def _frames(self, buf):
+        offset = 0
+        end = len(buf)
+        while offset + 15 <= end:
+            n = (
+                ((buf[offset + 3] & 0x3) << 11)
+                | (buf[offset + 4] << 3)
+                | (buf[offset + 5] >> 5)
+            )
+            if offset + n > end:
+                break
+            seq_num, index, _ = unpack_from(FRAME_HEADER, buf, offset + 7)
+            if index == 0:
+                self.segments.append(seq_num)
+            self.frames += 1
+            offset += n
+        return buf[offset:]
+
+    @property
+    def dropped(self):
+        return sum(
+            max(b - a - 1, 0) for a, b in zip(self.segments, self.segments[1:])
+        )
+
+    @property
+    def duplicated(self):
+        return sum(
+            1 for a, b in zip(self.segments, self.segments[1:]) if b <= a
+        )
+
+
+def run(args):
+    origin = FakeOrigin(duration=args.duration, latency=args.origin_latency)
+    origin.start()
+
+    conn, child = Pipe()
+    proxy = Process(
+        target=_serve,
+        args=(_OriginUrls(origin), args.clients + 4, child),
+        name='proxy',
+        daemon=True,
+    )
+    proxy.start()
+    base = f'http://127.0.0.1:{conn.recv()}'
+
+    def measure():
+        conn.send(True)
+        return conn.recv()
+
+    # pytube insists on 11 character ids
+    vids = [f'bench{i:06d}' for i in range(args.streams)]
+
+    rss_before, cpu_before = measure()
+    started_at = time()
+
+    stop = Event()
+    clients = []
+    for i in range(args.clients):
+        client = Client(f'{base}/{vids[i % len(vids)]}', stop)
+        client.start()
+        clients.append(client)
+        if args.ramp:
+            sleep(args.ramp)
+
+    sleep(args.seconds)
+    rss_during, cpu = measure()
+    elapsed = time() - started_at
+    cpu -= cpu_before
+    stop.set()
+    for client in clients:
+        client.join(timeout=args.duration * 2)
+    conn.send(False)
+    proxy.join()
+    origin.stop()
+
+    ttfbs = [c.ttfb for c in clients if c.ttfb is not None]
+    distinct = len(origin.served)
+    results = {
+        'clients': args.clients,
+        'streams': args.streams,
+        'seconds': round(elapsed, 3),
+        'errors': sum(1 for c in clients if c.error),
+        'ttfb_median': median(ttfbs) if ttfbs else None,
+        'ttfb_max': max(ttfbs) if ttfbs else None,
+        'cpu_per_stream': cpu / args.streams,
+        'cpu_per_stream_second': cpu / args.streams / elapsed,
+        'upstream_requests': origin.total_requests,
+        'upstream_segments': distinct,
+        'upstream_requests_per_segment': (
+            origin.total_requests / distinct if distinct else None
+        ),
+        'memory_per_listener': (rss_during - rss_before) / args.clients,
+        'bytes_per_listener': mean(c.bytes for c in clients),
+        'frames_per_listener': mean(c.frames for c in clients),
+        'dropped_segments': sum(c.dropped for c in clients),
+        'duplicated_segments': sum(c.duplicated for c in clients),
+    }
+    return results
+
+
+def main():
+    parser = ArgumentParser(
+        description='Load youtube-proxy against a local fake live origin'
+    )
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--streams', type=int, default=2)
+    parser.add_argument(
+        '--seconds', type=float, default=20, help='how long to listen for'
+    )
+    parser.add_argument(
+        '--duration', type=float, default=1.0, help='segment cadence'
+    )
+    parser.add_argument(
+        '--origin-latency',
+        type=float,
+        default=0.0,
+        help='added to every upstream response',
+    )
+    parser.add_argument(
+        '--ramp', type=float, default=0.0, help='delay between new clients'
+    )
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(dumps(results, indent=2))
+    else:
+        width = max(len(k) for k in results)
+        for k, v in results.items():
+            if isinstance(v, float):
+                v = f'{v:.4f}'
+            print(f'{k:<{width}}  {v}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#
+#
+#
+
+from struct import pack
+
+# synthetic fragmented mp4 audio segments shaped like the ones googlevideo
+# hands out for live streams, ftyp + moov + moof + mdat, each AAC "frame" is
+# junk but starts with its seq_num, sample index, and sample count so that
+# clients can spot dropped or duplicated segments
+
+SAMPLE_RATES = (
+    96000,
+    88200,
+    64000,
+    48000,
+    44100,
+    32000,
+    24000,
+    22050,
+    16000,
+    12000,
+    11025,
+    8000,
+    7350,
+)
+SAMPLES_PER_FRAME = 1024
+FRAME_HEADER = '>IHH'
+
+
+def _box(_type, payload):
+    return pack('>I4s', 8 + len(payload), _type.encode('ascii')) + payload
+
+
+def _full_box(_type, version, flags, payload):
+    return _box(_type, pack('>I', (version << 24) | flags) + payload)
+
+
+def _esds(sample_rate, channels):
+    sampling_frequency_index = SAMPLE_RATES.index(sample_rate)
+    # AAC-LC
+    asc = pack(
+        '>H', (2 << 11) | (sampling_frequency_index << 7) | (channels << 3)
+    )
+    dsi = bytes((0x05, len(asc))) + asc
+    dcd = bytes((0x04, 13 + len(dsi), 0x40, 0x15)) + bytes(11) + dsi
+    sl = bytes((0x06, 0x01, 0x02))
+    es = bytes((0x03, 3 + len(dcd) + len(sl), 0x00, 0x01, 0x00)) + dcd + sl
+    return _full_box('esds', 0, 0, es)
+
+
+def init(sample_rate=44100, channels=2):
+    ftyp = _box('ftyp', b'dash' + pack('>I', 0) + b'iso6mp41')
+    mvhd = _full_box(
+        'mvhd', 0, 0, pack('>IIII', 0, 0, sample_rate, 0) + bytes(80)
+    )
+    mp4a = _box(
+        'mp4a',
+        bytes(6)
+        + pack('>H', 1)
+        + bytes(8)
+        + pack('>HH4xI', channels, 16, sample_rate << 16)
+        + _esds(sample_rate, channels),
+    )
+    stsd = _full_box('stsd', 0, 0, pack('>I', 1) + mp4a)
+    mdhd = _full_box('mdhd', 0, 0, pack('>IIIIHH', 0, 0, sample_rate, 0, 0, 0))
+    minf = _box('minf', _box('stbl', stsd))
+    trak = _box(
+        'trak', _full_box('tkhd', 0, 3, bytes(80)) + _box('mdia', mdhd + minf)
+    )
+    return ftyp + _box('moov', mvhd + trak)
+
+
+def segment(seq_num, samples, sample_rate=44100, channels=2, frame_size=256):
+    header_size = 8
+    frames = [
+        pack(FRAME_HEADER, seq_num, i, samples).ljust(frame_size, b'\0')
+        for i in range(samples)
+    ]
+    sizes = b''.join(pack('>I', len(f)) for f in frames)
+
+    def moof(data_offset):
+        mfhd = _full_box('mfhd', 0, 0, pack('>I', seq_num))
+        tfhd = _full_box('tfhd', 0, 0x020008, pack('>II', 1, SAMPLES_PER_FRAME))
+        tfdt = _full_box(
+            'tfdt', 1, 0, pack('>Q', seq_num * samples * SAMPLES_PER_FRAME)
+        )
+        trun = _full_box(
+            'trun', 0, 0x000201, pack('>Ii', samples, data_offset) + sizes
+        )
+        return _box('moof', mfhd + _box('traf', tfhd + tfdt + trun))
+
+    # data_offset is relative to the start of moof and points just past the
+    # mdat's header
+    size = len(moof(0))
+    return (
+        init(sample_rate, channels)
+        + moof(size + header_size)
+        + _box('mdat', b''.join(frames))
+    )
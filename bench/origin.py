@@ -0,0 +1,137 @@
+#
+#
+#
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from threading import Lock, Thread
+from time import sleep, time
+from urllib.parse import parse_qs, urlparse
+
+from .fmp4 import SAMPLES_PER_FRAME, segment
+
+
+# A stand-in for googlevideo's live endpoints. Each video id gets a rolling
+# head segment that advances every duration seconds, the base url serves the
+# head and &sq=N asks for a specific segment. Responses carry x-sequence-num,
+# x-head-seqnum, and x-walltime-ms like the real thing.
+class FakeOrigin:
+    log = getLogger('FakeOrigin')
+
+    def __init__(
+        self,
+        host='127.0.0.1',
+        port=0,
+        duration=1.0,
+        sample_rate=44100,
+        channels=2,
+        latency=0.0,
+        first_seq_num=1000,
+    ):
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.latency = latency
+        self.first_seq_num = first_seq_num
+        self.samples = round(duration * sample_rate / SAMPLES_PER_FRAME)
+
+        self.started_at = time()
+        self._lock = Lock()
+        self._segments = {}
+        self.requests = Counter()
+        self.served = Counter()
+
+        handler = type('Handler', (_Handler,), {'origin': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def url(self, vid):
+        # expire far enough out that the resolver never bothers refreshing
+        return f'http://{self.host}:{self.port}/{vid}/videoplayback?expire={int(time()) + 86400}'
+
+    def start(self):
+        self.log.info('start: port=%d, duration=%f', self.port, self.duration)
+        self._thread = Thread(
+            target=self._server.serve_forever, name='FakeOrigin', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def head_seq_num(self, now=None):
+        now = time() if now is None else now
+        return self.first_seq_num + int((now - self.started_at) / self.duration)
+
+    def walltime(self, seq_num):
+        return self.started_at + (seq_num - self.first_seq_num) * self.duration
+
+    def segment(self, seq_num):
+        # every listener of every video wants the same few around the head so
+        # keep the recent ones around
+        with self._lock:
+            try:
+                return self._segments[seq_num]
+            except KeyError:
+                data = segment(
+                    seq_num, self.samples, self.sample_rate, self.channels
+                )
+                self._segments[seq_num] = data
+                for old in [s for s in self._segments if s < seq_num - 32]:
+                    del self._segments[old]
+                return data
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    @property
+    def total_segments(self):
+        return sum(self.served.values())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    origin = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+    def do_GET(self):
+        origin = self.origin
+        url = urlparse(self.path)
+        vid = url.path.strip('/').split('/')[0]
+        query = parse_qs(url.query)
+
+        origin.requests[vid] += 1
+        if origin.latency:
+            sleep(origin.latency)
+
+        head_seq_num = origin.head_seq_num()
+        try:
+            seq_num = int(query['sq'][0])
+        except KeyError:
+            seq_num = head_seq_num
+
+        if seq_num > head_seq_num:
+            self.send_response(404)
+            self.send_header('content-length', '0')
+            self.end_headers()
+            return
+
+        origin.served[(vid, seq_num)] += 1
+        body = origin.segment(seq_num)
+        self.send_response(200)
+        self.send_header('content-type', 'audio/mp4')
+        self.send_header('content-length', str(len(body)))
+        self.send_header('x-sequence-num', str(seq_num))
+        self.send_header('x-head-seqnum', str(head_seq_num))
+        self.send_header(
+            'x-walltime-ms', str(int(origin.walltime(seq_num) * 1000))
+        )
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,20 @@
+#
+#
+#
+
+from unittest import TestCase
+
+from youtube_proxy.encode import parse_bitrate
+
+
+class ParseBitrateTest(TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_bitrate('96k'), 96000)
+        self.assertEqual(parse_bitrate(' 128000 '), 128000)
+        self.assertEqual(parse_bitrate('64.5K'), 64500)
+
+    def test_invalid(self):
+        for bitrate in ('', 'abc', '1', '1000k', 'inf', '-infk', 'nan'):
+            with self.subTest(bitrate=bitrate):
+                with self.assertRaises(ValueError):
+                    parse_bitrate(bitrate)
@@ -0,0 +1,128 @@
+#
+#
+#
+
+from struct import pack
+from unittest import TestCase
+
+from bench.fmp4 import SAMPLES_PER_FRAME, _box, _full_box, init, segment
+from youtube_proxy.mp4 import Mp4, Mp4Parser
+
+
+def _moof(trafs):
+    mfhd = _full_box('mfhd', 0, 0, pack('>I', 1))
+    return _box('moof', mfhd + b''.join(trafs))
+
+
+def _trun(sizes, data_offset=None):
+    flags = 0x200
+    body = pack('>I', len(sizes))
+    if data_offset is not None:
+        flags |= 0x1
+        body += pack('>i', data_offset)
+    body += b''.join(pack('>I', size) for size in sizes)
+    return _full_box('trun', 0, flags, body)
+
+
+def _traf(truns, flags=0x020008, base=None):
+    body = pack('>I', 1)
+    if base is not None:
+        flags |= 0x1
+        body += pack('>Q', base)
+    body += pack('>I', SAMPLES_PER_FRAME)
+    tfhd = _full_box('tfhd', 0, flags, body)
+    tfdt = _full_box('tfdt', 1, 0, pack('>Q', 0))
+    return _box('traf', tfhd + tfdt + b''.join(truns))
+
+
+class ParserEquivalenceTest(TestCase):
+    # Mp4Parser fed in pieces has to pick out the same frames as the index
+    frames = [bytes([i]) * (50 + i) for i in range(10)]
+    pad = b'\xee' * 13
+
+    def _stream(self, data, step):
+        parser = Mp4Parser()
+        frames = []
+        for i in range(0, len(data), step):
+            frames.extend(parser.feed(data[i : i + step]))
+        return frames
+
+    def _check(self, data, expected=None):
+        frames = [bytes(f) for f in Mp4(data).frames]
+        if expected is not None:
+            self.assertEqual(frames, expected)
+        for step in (1, 7, 100, 1000, len(data)):
+            with self.subTest(step=step):
+                self.assertEqual(self._stream(data, step), frames)
+
+    def _split(self):
+        a, b = self.frames[:5], self.frames[5:]
+        return a, b, [len(f) for f in a], [len(f) for f in b]
+
+    def test_segment(self):
+        self._check(segment(1, 20))
+
+    def test_two_fragments(self):
+        self._check(segment(1, 20) + segment(2, 20)[len(init()) :])
+
+    def test_no_data_offset(self):
+        # back to back from the start of the mdat payload
+        _, _, sa, sb = self._split()
+        moof = _moof([_traf([_trun(sa), _trun(sb)])])
+        mdat = _box('mdat', b''.join(self.frames))
+        self._check(init() + moof + mdat, self.frames)
+
+    def test_size0_mdat(self):
+        _, _, sa, sb = self._split()
+        moof = _moof([_traf([_trun(sa), _trun(sb)])])
+        mdat = pack('>I4s', 0, b'mdat') + b''.join(self.frames)
+        self._check(init() + moof + mdat, self.frames)
+
+    def test_largesize_mdat(self):
+        _, _, sa, sb = self._split()
+        body = b''.join(self.frames)
+        mdat = pack('>I4sQ', 1, b'mdat', 16 + len(body)) + body
+        # without a data_offset the runs start at the payload
+        moof = _moof([_traf([_trun(sa), _trun(sb)])])
+        self._check(init() + moof + mdat, self.frames)
+        # with one they're relative to the moof, past the 16 byte header
+        moof = _moof([_traf([_trun(sa, 0), _trun(sb, 0)])])
+        start = len(moof) + 16
+        moof = _moof([_traf([_trun(sa, start), _trun(sb, start + sum(sa))])])
+        self._check(init() + moof + mdat, self.frames)
+
+    def test_reordered(self):
+        # padding between the runs, the second run ahead of the first
+        a, b, sa, sb = self._split()
+        moof = _moof([_traf([_trun(sa, 0), _trun(sb, 0)])])
+        start = len(moof) + 8
+        moof = _moof(
+            [
+                _traf(
+                    [
+                        _trun(sa, start + sum(sb) + len(self.pad)),
+                        _trun(sb, start),
+                    ]
+                )
+            ]
+        )
+        mdat = _box('mdat', b''.join(b) + self.pad + b''.join(a))
+        self._check(init() + moof + mdat, self.frames)
+
+    def test_base_data_offset(self):
+        # the second traf placed by an absolute base_data_offset
+        a, b, sa, sb = self._split()
+        pre = init()
+        moof = _moof(
+            [_traf([_trun(sa, 0)]), _traf([_trun(sb)], flags=0x8, base=0)]
+        )
+        start = len(moof) + 8
+        base = len(pre) + start + sum(sa) + len(self.pad)
+        moof = _moof(
+            [
+                _traf([_trun(sa, start)]),
+                _traf([_trun(sb)], flags=0x8, base=base),
+            ]
+        )
+        mdat = _box('mdat', b''.join(a) + self.pad + b''.join(b))
+        self._check(pre + moof + mdat, self.frames)
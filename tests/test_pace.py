@@ -0,0 +1,75 @@
+#
+#
+#
+
+from unittest import TestCase
+
+from youtube_proxy.pace import Pacer
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+
+class _RecordingPacer(Pacer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reanchors = []
+
+    def _reanchor(self, media_time, reason):
+        self.reanchors.append(reason)
+        super()._reanchor(media_time, reason)
+
+
+class PacerTest(TestCase):
+    def _listen(self, arrivals, duration=5.0, frames=50, **kwargs):
+        # segments of frames that turn up at arrivals, returns the pacer and
+        # when each frame went out relative to when it should be playing
+        clock = _Clock()
+        pacer = _RecordingPacer(clock=clock, sleep=clock.sleep, **kwargs)
+        step = duration / frames
+        leads = []
+        for n, arrival in enumerate(arrivals):
+            clock.now = max(clock.now, 100.0 + arrival)
+            times = [(n * duration + i * step, step) for i in range(frames)]
+            for run in pacer.pace(list(range(frames)), times):
+                for i in run:
+                    leads.append(pacer._scheduled(times[i][0]) - clock.now)
+        return pacer, leads
+
+    def test_real_time(self):
+        # each segment turns up as the last one's done, a little late
+        arrivals = [0.3 + n * 5.0 for n in range(10)]
+        pacer, leads = self._listen(arrivals, ahead=2.0, delay=1.0)
+        self.assertEqual(['start'], pacer.reanchors)
+        # never more than ahead in front, and never late
+        self.assertLessEqual(max(leads), 2.0 + 1e-9)
+        self.assertGreaterEqual(min(leads), 0)
+
+    def test_jitter(self):
+        # late by less than delay is soaked up
+        arrivals = [n * 5.0 + (0.8 if n % 2 else 0) for n in range(10)]
+        pacer, _ = self._listen(arrivals, ahead=2.0, delay=1.0)
+        self.assertEqual(['start'], pacer.reanchors)
+
+    def test_behind(self):
+        # a segment that turns up after it should've been playing
+        arrivals = [0, 5.0, 12.0, 15.0]
+        pacer, leads = self._listen(arrivals, ahead=2.0, delay=1.0)
+        self.assertEqual(['start', 'behind'], pacer.reanchors)
+        self.assertGreaterEqual(min(leads), 0)
+
+    def test_starts_with_ahead_less_delay(self):
+        clock = _Clock()
+        pacer = Pacer(ahead=2.0, delay=0.5, clock=clock, sleep=clock.sleep)
+        times = [(i * 0.1, 0.1) for i in range(50)]
+        first = next(pacer.pace(list(range(50)), times))
+        self.assertEqual(100.0, clock.now)
+        self.assertEqual(16, len(first))
@@ -0,0 +1,75 @@
+#
+#
+#
+
+from queue import Queue
+from time import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+from youtube_proxy.youtube import YouTubeStreamer
+
+
+def _chunk(seq_num, head_seq_num):
+    return SimpleNamespace(
+        seq_num=seq_num,
+        head_seq_num=head_seq_num,
+        seen_at=time(),
+        mp4=SimpleNamespace(duration=None),
+    )
+
+
+# Stands in for googlevideo, seq_nums up to last are published, anything after
+# never is, and the head is each of heads in turn, sticking on the last
+class _Streamer(YouTubeStreamer):
+    def __init__(self, last, heads, **kwargs):
+        super().__init__(
+            SimpleNamespace(id='test0000000'),
+            duration=0.05,
+            queue=Queue(),
+            incremental=False,
+            **kwargs,
+        )
+        self.last = last
+        self.heads = list(heads)
+        self.fetches = 0
+
+    def url(self):
+        return 'https://upstream/videoplayback?expire=0'
+
+    def fetch(self, url):
+        head = self.heads.pop(0) if len(self.heads) > 1 else self.heads[0]
+        return _chunk(head, head)
+
+    def fetch_seq(self, url, seq_num):
+        self.fetches += 1
+        if seq_num > self.last:
+            return None
+        return _chunk(seq_num, self.last)
+
+    def chunks(self):
+        seq_nums = []
+        while (chunk := self.queue.get(timeout=1)) is not None:
+            seq_nums.append(chunk.seq_num)
+        return seq_nums
+
+
+class FollowTest(TestCase):
+    def test_ended(self):
+        # the head's stuck on the last segment, nothing more is coming
+        streamer = _Streamer(last=3, heads=[3])
+        streamer.start()
+        streamer.join(2)
+        self.assertFalse(streamer.is_alive())
+        self.assertEqual([3], streamer.chunks())
+        # roughly max_not_ready durations at 20 a duration, not unbounded
+        self.assertLess(streamer.fetches, 100)
+
+    def test_skipped(self):
+        # 4 never shows up but the head's moved on past it, and then it's
+        # over
+        streamer = _Streamer(last=3, heads=[3, 6], max_not_ready=1)
+        streamer.start()
+        streamer.join(2)
+        self.assertFalse(streamer.is_alive())
+        self.assertEqual([3, 6], streamer.chunks())
@@ -3,11 +3,27 @@
 # Based loosely off of https://www.deadf00d.com/post/how-i-hacked-sonos-and-youtube-the-same-day.html
 # and pytube
 
+from .broadcast import BufferLimits, Broadcasters
+from .encode import (
+    FORMATS as ENCODE_FORMATS,
+    EncoderPool,
+    Renditions,
+    available as encode_available,
+    parse_bitrate,
+)
+from .hls import CONTAINERS as HLS_CONTAINERS, HlsPackager, SegmentCache
+from .hub import HubResolver, hub_streamer
+from .metrics import render as render_metrics
+from .pace import Pacer
+from .session import configure as configure_session
+from .trace import tracer
 from .transcode import Transcoder
-from .youtube import YouTube, YouTubeStreamer
+from .warm import Warmer
+from .vod import RangeNotSatisfiable, VodDownloader
+from .youtube import StreamResolver, YouTube, streamers
 
 
-from flask import Flask, Response
+from flask import Flask, Response, abort, jsonify, request
 from http.client import HTTPConnection  # py3
 from logging import getLogger
 from logging.config import dictConfig
@@ -40,13 +56,247 @@ dictConfig(
 )
 
 
+def _preroll():
+    # how many already fetched segments new listeners start with
+    return int(environ.get('PREROLL_SEGMENTS', '1'))
+
+
+def _limits():
+    # how far behind a listener can get, and what happens when they do
+    return BufferLimits(
+        chunks=int(environ.get('BUFFER_SEGMENTS', '4')),
+        bytes=int(environ.get('BUFFER_BYTES', str(8 * 1024 * 1024))),
+        policy=environ.get('SLOW_CONSUMER_POLICY', BufferLimits.DROP_OLDEST),
+    )
+
+
+def upstream():
+    # Broadcasters that fetch from youtube themselves, either for the app or
+    # for a hub that workers subscribe to
+    configure_session(
+        pool_size=int(environ.get('HTTP_POOL_SIZE', '32')),
+        keep_alive=int(environ.get('HTTP_KEEP_ALIVE', '60')),
+    )
+
+    broadcasters = Broadcasters(
+        preroll=_preroll(), resolver=StreamResolver(), limits=_limits()
+    )
+
+    # stop any streamer that hasn't produced anything in a while, e.g. a live
+    # stream that has ended
+    streamers.start_reaper(
+        idle_after=float(environ.get('STREAMER_IDLE_AFTER', '120'))
+    )
+
+    # favourites kept resolved, connected, and buffered ahead of anyone
+    # asking, WARM_VIDEOS is a comma separated list of ids and/or
+    # WARM_VIDEOS_FILE a file of them
+    videos = environ.get('WARM_VIDEOS')
+    path = environ.get('WARM_VIDEOS_FILE')
+    if videos or path:
+        Warmer(
+            broadcasters,
+            videos=videos,
+            path=path,
+            interval=float(environ.get('WARM_INTERVAL', '300')),
+        ).start()
+
+    return broadcasters
+
+
 def create_app():
     app = Flask('sonos-proxy')
 
+    preroll = _preroll()
+    limits = _limits()
+    hub_socket = environ.get('HUB_SOCKET')
+    if hub_socket:
+        # another process owns the upstream fetching, see youtube_proxy.hub
+        broadcasters = Broadcasters(
+            preroll=preroll, limits=limits, streamer=hub_streamer(hub_socket)
+        )
+        # it resolves too, once for every worker
+        resolver = HubResolver(hub_socket)
+    else:
+        broadcasters = upstream()
+        resolver = broadcasters.resolver
+    vod_piece_size = int(environ.get('VOD_PIECE_BYTES', str(1024 * 1024)))
+    vod_parallelism = int(environ.get('VOD_PARALLELISM', '4'))
+    # real-time pacing of the live ADTS, the most a listener gets ahead of
+    # the clock, PACE_AHEAD=0 turns it off
+    pace_ahead = float(environ.get('PACE_AHEAD', '2'))
+    # and how far behind upstream it plays, to ride out late segments
+    pace_delay = float(environ.get('PACE_DELAY', '1'))
+
+    # re-encoded renditions, ?format=mp3&bitrate=96k, each encoded once in a
+    # worker process and shared by all of its listeners
+    renditions = Renditions(
+        broadcasters,
+        EncoderPool(int(environ.get('TRANSCODE_WORKERS', '0')) or None),
+        preroll=preroll,
+        limits=limits,
+    )
+
+    # HLS re-serving of the same broadcasts, segments come out of a shared
+    # cache so that a caching proxy in front of us can absorb the fan-out
+    segment_ttl = float(environ.get('HLS_CACHE_TTL', '60'))
+    # per-chunk timeline of each stream's stages, TRACE_SPANS spans kept per
+    # stream, 0 is off, see /debug/trace. TRACE_PROFILE=1 runs the stages
+    # under cProfile as well, see /debug/profile
+    tracer.configure(
+        size=int(environ.get('TRACE_SPANS', '0')),
+        profiling=bool(int(environ.get('TRACE_PROFILE', '0'))),
+    )
+
+    hls = HlsPackager(
+        broadcasters,
+        SegmentCache(
+            max_bytes=int(
+                environ.get('HLS_CACHE_BYTES', str(64 * 1024 * 1024))
+            ),
+            ttl=segment_ttl,
+        ),
+        window=int(environ.get('HLS_WINDOW', '6')),
+        idle_after=float(environ.get('HLS_IDLE_AFTER', '30')),
+    )
+
+    @app.route('/healthz')
+    def healthz():
+        return 'ok'
+
+    @app.route('/debug/streamers')
+    def debug_streamers():
+        return jsonify(streamers.describe())
+
+    @app.route('/debug/trace')
+    def debug_trace():
+        vid = request.args.get('vid')
+        if request.args.get('format') == 'chrome':
+            return jsonify(tracer.chrome(vid))
+        return jsonify(tracer.json(vid))
+
+    @app.route('/debug/profile', methods=('GET', 'POST'))
+    def debug_profile():
+        # POST ?enable=1 starts, over, and ?enable=0 stops profiling
+        if request.method == 'POST':
+            try:
+                tracer.profile(bool(int(request.args['enable'])))
+            except (KeyError, ValueError):
+                abort(400)
+        return Response(tracer.report(), mimetype='text/plain')
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/<string:vid>/playlist.m3u8')
+    def hls_playlist(vid):
+        container = request.args.get('container', HLS_CONTAINERS[0])
+        if container not in HLS_CONTAINERS:
+            abort(400)
+        if not resolver.resolve(YouTube(vid)).live:
+            # regular videos are served whole, from /<vid>
+            abort(404)
+        playlist = hls.playlist(vid, container)
+        if playlist is None:
+            abort(503)
+        resp = Response(playlist, mimetype='application/vnd.apple.mpegurl')
+        # live playlists change every segment
+        resp.cache_control.max_age = 1
+        return resp
+
+    @app.route('/<string:vid>/<string:name>')
+    def hls_segment(vid, name):
+        data = hls.segment(vid, name)
+        if data is None:
+            abort(404)
+        mimetype = 'audio/mp4' if name.endswith('.mp4') else 'audio/aac'
+        resp = Response(data, mimetype=mimetype)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = int(segment_ttl)
+        return resp
+
     @app.route('/<string:vid>')
     def youtube(vid):
-        yts = YouTubeStreamer(YouTube(vid))
-        return Response(Transcoder(yts).acc_audio(), mimetype='audio/aac')
+        resolved = resolver.resolve(YouTube(vid))
+        if not resolved.live:
+            return vod(vid, resolved)
+
+        _format = request.args.get('format')
+        if _format is not None:
+            return encoded(vid, _format, request.args.get('bitrate', '128k'))
+
+        subscription = broadcasters.subscribe(vid)
+        pacer = (
+            Pacer(ahead=pace_ahead, delay=pace_delay)
+            if pace_ahead > 0
+            else None
+        )
+        resp = Response(
+            Transcoder(subscription, pacer=pacer).acc_audio(),
+            mimetype='audio/aac',
+        )
+        # the generator's own cleanup won't run if it never got started
+        resp.call_on_close(subscription.close)
+        return resp
+
+    def vod(vid, resolved):
+        downloader = VodDownloader(
+            vid,
+            resolved.url,
+            resolved.size,
+            piece_size=vod_piece_size,
+            parallelism=vod_parallelism,
+        )
+        try:
+            span = downloader.span(request.range)
+        except RangeNotSatisfiable:
+            resp = Response(status=416)
+            resp.content_range = f'bytes */{resolved.size}'
+            return resp
+
+        if span is None:
+            start, end = 0, resolved.size - 1
+            status = 200
+        else:
+            start, end = span
+            status = 206
+        resp = Response(
+            downloader.iter_range(start, end),
+            status=status,
+            mimetype=resolved.mime_type.split(';')[0],
+        )
+        resp.accept_ranges = 'bytes'
+        resp.content_length = end - start + 1
+        if status == 206:
+            resp.content_range = f'bytes {start}-{end}/{resolved.size}'
+        return resp
+
+    def encoded(vid, _format, bitrate):
+        if _format not in ENCODE_FORMATS:
+            abort(400)
+        if not encode_available():
+            abort(501)
+        try:
+            bitrate = parse_bitrate(bitrate)
+        except ValueError:
+            abort(400)
+
+        subscription = renditions.subscribe(vid, _format, bitrate)
+        resp = Response(
+            Transcoder(subscription).encoded(),
+            mimetype=ENCODE_FORMATS[_format][2],
+        )
+        resp.call_on_close(subscription.close)
+        return resp
+
+    # for anything serving the same streams outside of flask, e.g. asgi
+    app.extensions['youtube_proxy'] = {
+        'broadcasters': broadcasters,
+        'resolver': resolver,
+        'pace_ahead': pace_ahead,
+        'pace_delay': pace_delay,
+    }
 
     getLogger().info('Example URL: http://<host-fqdn>:<port>/jfKfPfyJRdk')
     return app
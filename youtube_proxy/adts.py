@@ -0,0 +1,99 @@
+#
+#
+#
+
+from functools import lru_cache
+from logging import getLogger
+
+
+class AdtsWriter:
+    log = getLogger('AdtsWriter')
+
+    HEADER_SIZE = 7
+    # what we've always assumed when there's no esds to go on, AAC-LC,
+    # 44.1kHz, stereo
+    DEFAULT_CONFIG = (2, 4, 2)
+
+    @classmethod
+    def from_esds(cls, esds):
+        if esds is None or esds.audio_object_type is None:
+            cls.log.warning(
+                'from_esds: no esds, assuming AAC-LC 44.1kHz stereo'
+            )
+            return cls._for(cls.DEFAULT_CONFIG)
+        return cls._for(
+            (
+                esds.audio_object_type,
+                esds.sampling_frequency_index,
+                esds.channel_configuration,
+            )
+        )
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _for(cls, config):
+        # every chunk gets one, writers don't change once made so they're
+        # shared by everything with the same config
+        return cls(*config)
+
+    def __init__(
+        self, audio_object_type, sampling_frequency_index, channel_configuration
+    ):
+        self.log.info(
+            '__init__: audio_object_type=%d, sampling_frequency_index=%d, channel_configuration=%d',
+            audio_object_type,
+            sampling_frequency_index,
+            channel_configuration,
+        )
+        self.config = (
+            audio_object_type,
+            sampling_frequency_index,
+            channel_configuration,
+        )
+
+        profile = audio_object_type - 1
+        if not 0 <= profile <= 3:
+            raise ValueError(
+                f'audio_object_type={audio_object_type} cannot be carried in ADTS'
+            )
+
+        # everything but the 13-bit frame length is fixed for the stream:
+        # syncword, MPEG-4, layer 0, no CRC, profile, sampling frequency
+        # index, channel configuration, buffer fullness 0x7ff (VBR) and a
+        # single raw data block
+        self._header = bytes(
+            (
+                0xFF,
+                0xF1,
+                (profile << 6)
+                | (sampling_frequency_index << 2)
+                | (channel_configuration >> 2),
+                (channel_configuration & 0x3) << 6,
+                0x00,
+                0x1F,
+                0xFC,
+            )
+        )
+        self._byte3 = self._header[3]
+
+    def write(self, frames):
+        frames = list(frames)
+        header_size = self.HEADER_SIZE
+        byte3 = self._byte3
+
+        # one buffer holding every frame's header, patched in place, and then
+        # a single join to interleave them with the frames
+        headers = bytearray(self._header * len(frames))
+        view = memoryview(headers)
+        parts = []
+        o = 0
+        for frame in frames:
+            n = len(frame) + header_size
+            headers[o + 3] = byte3 | (n >> 11)
+            headers[o + 4] = (n >> 3) & 0xFF
+            headers[o + 5] = ((n & 0x7) << 5) | 0x1F
+            parts.append(view[o : o + header_size])
+            parts.append(frame)
+            o += header_size
+
+        return b''.join(parts)
@@ -0,0 +1,46 @@
+#
+#
+#
+
+from asyncio import TimeoutError, get_running_loop, wait_for
+from time import monotonic
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Lets coroutines wait on state that threads signal through a Condition, e.g.
+# a Broadcaster's ring or a chunk that's still downloading. Whatever calls
+# the Condition's notify_all calls notify as well.
+class AsyncWaiters:
+    def __init__(self):
+        self._waiters = set()
+
+    def notify(self):
+        # called with the Condition held
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait_for(self, cond, predicate, timeout=None):
+        loop = get_running_loop()
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            with cond:
+                if predicate():
+                    return True
+                waiter = (loop, loop.create_future())
+                self._waiters.add(waiter)
+            try:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                await wait_for(waiter[1], remaining)
+            except TimeoutError:
+                return False
+            finally:
+                with cond:
+                    self._waiters.discard(waiter)
@@ -0,0 +1,226 @@
+#
+#
+#
+
+from asyncio import (
+    FIRST_COMPLETED,
+    CancelledError,
+    ensure_future,
+    get_running_loop,
+    wait,
+)
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from logging import getLogger
+from os import environ
+from sys import stderr
+
+from . import create_app
+from .pace import Pacer
+from .transcode import Transcoder
+from .youtube import YouTube
+
+log = getLogger('AsgiApp')
+
+
+async def _body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _disconnected(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+    return environ
+
+
+async def _stream(send, receive, status, headers, body):
+    # send body, an async iterator, until it runs out or the client goes away
+    await send(
+        {'type': 'http.response.start', 'status': status, 'headers': headers}
+    )
+    disconnected = ensure_future(_disconnected(receive))
+    try:
+        while True:
+            data = ensure_future(body.__anext__())
+            await wait((data, disconnected), return_when=FIRST_COMPLETED)
+            if not data.done():
+                # gone while we were waiting on the next bit
+                data.cancel()
+                try:
+                    await data
+                except (CancelledError, StopAsyncIteration):
+                    pass
+                break
+            try:
+                chunk = data.result()
+            except StopAsyncIteration:
+                await send({'type': 'http.response.body', 'body': b''})
+                break
+            if disconnected.done():
+                break
+            await send(
+                {'type': 'http.response.body', 'body': chunk, 'more_body': True}
+            )
+    finally:
+        disconnected.cancel()
+        await body.aclose()
+
+
+async def _wsgi_body(result, executor):
+    # a WSGI response's iterable, pulled on executor
+    loop = get_running_loop()
+    it = iter(result)
+    sentinel = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, it, sentinel)
+            if chunk is sentinel:
+                return
+            if chunk:
+                yield chunk
+    finally:
+        close = getattr(result, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(executor, close)
+
+
+# An ASGI app for serving live streams from coroutines rather than a thread
+# per listener. Live ADTS is handled here, on the loop, everything else is
+# handed to the flask app on its own pool of threads. Renditions and regular
+# videos block a thread for as long as they're playing, on the default
+# executor a handful of them would hold up every live listener's resolves,
+# subscribes, and closes.
+class AsgiApp:
+    def __init__(self, wsgi, wsgi_threads=64):
+        self.wsgi = wsgi
+        self._executor = ThreadPoolExecutor(
+            max_workers=wsgi_threads, thread_name_prefix='AsgiWsgi'
+        )
+        state = wsgi.extensions['youtube_proxy']
+        self.broadcasters = state['broadcasters']
+        self.resolver = state['resolver']
+        self.pace_ahead = state['pace_ahead']
+        self.pace_delay = state['pace_delay']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        if await self._live(scope, receive, send):
+            return
+        await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _live(self, scope, receive, send):
+        # /<vid> for a live stream with no format, anything else is flask's
+        vid = scope['path'].strip('/')
+        if (
+            scope['method'] != 'GET'
+            or not vid
+            or '/' in vid
+            or vid in ('healthz', 'metrics')
+            or scope['query_string']
+        ):
+            return False
+
+        log.info('_live: vid=%s', vid)
+        loop = get_running_loop()
+        # resolving can mean pytube and a watch page fetch
+        resolved = await loop.run_in_executor(
+            None, self.resolver.resolve, YouTube(vid)
+        )
+        if not resolved.live:
+            return False
+
+        subscription = await loop.run_in_executor(
+            None, self.broadcasters.subscribe, vid
+        )
+        pacer = (
+            Pacer(ahead=self.pace_ahead, delay=self.pace_delay)
+            if self.pace_ahead > 0
+            else None
+        )
+        body = Transcoder(subscription, pacer=pacer).acc_audio_async()
+        await _stream(
+            send, receive, 200, [(b'content-type', b'audio/aac')], body
+        )
+        return True
+
+    async def _wsgi(self, scope, receive, send):
+        environ = _environ(scope, await _body(receive))
+        loop = get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (n.lower().encode('latin-1'), v.encode('latin-1'))
+                for n, v in headers
+            ]
+
+        result = await loop.run_in_executor(
+            self._executor, self.wsgi, environ, start_response
+        )
+        await _stream(
+            send,
+            receive,
+            started['status'],
+            started['headers'],
+            _wsgi_body(result, self._executor),
+        )
+
+
+def create_asgi_app():
+    # the most requests flask's handling at once, mostly renditions and
+    # regular videos
+    return AsgiApp(
+        create_app(), wsgi_threads=int(environ.get('ASGI_WSGI_THREADS', '64'))
+    )
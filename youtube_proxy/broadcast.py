@@ -0,0 +1,351 @@
+#
+#
+#
+
+from collections import deque
+from dataclasses import dataclass
+from logging import getLogger
+from queue import Empty
+from threading import Condition, Lock
+
+from .aio import AsyncWaiters
+from .metrics import SLOW_CONSUMER
+from .youtube import YouTube, YouTubeStreamer
+
+
+@dataclass
+class BufferLimits:
+    # what to do with a subscription that's more than chunks or bytes behind
+    DROP_OLDEST = 'drop-oldest'
+    PAUSE = 'pause'
+    DISCONNECT = 'disconnect'
+    POLICIES = (DROP_OLDEST, PAUSE, DISCONNECT)
+
+    chunks: int = 4
+    bytes: int = 8 * 1024 * 1024
+    policy: str = DROP_OLDEST
+    # longest we'll hold up fetching for a slow subscription before falling
+    # back to dropping its oldest chunks
+    max_pause: float = 10.0
+
+    def __post_init__(self):
+        if self.policy not in self.POLICIES:
+            raise ValueError(f'unknown policy={self.policy}')
+
+
+class Subscription:
+    def __init__(self, broadcaster, index):
+        self.broadcaster = broadcaster
+        self.index = index
+        self.disconnected = False
+        self.closed = False
+
+    @property
+    def vid(self):
+        return self.broadcaster.vid
+
+    def get(self, timeout=None):
+        return self.broadcaster._get(self, timeout)
+
+    async def aget(self, timeout=None):
+        return await self.broadcaster._aget(self, timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcaster.unsubscribe(self)
+
+    def __repr__(self):
+        return f'Subscription(vid={self.broadcaster.vid}, index={self.index})'
+
+
+# Runs a single YouTubeStreamer for a video and fans its chunks out to any
+# number of Subscriptions through a shared ring buffer
+class Broadcaster:
+    def __init__(
+        self,
+        vid,
+        size=8,
+        on_idle=None,
+        resolver=None,
+        limits=None,
+        streamer=None,
+    ):
+        self.vid = vid
+        self.log = getLogger(f'Broadcaster[{vid}]')
+        self.limits = limits or BufferLimits()
+        self.log.info('__init__: size=%d, limits=%s', size, self.limits)
+
+        self.on_idle = on_idle
+
+        self._cond = Condition()
+        # coroutines waiting on us, e.g. ASGI listeners
+        self._async = AsyncWaiters()
+        # enough room for every subscription's backlog
+        self._ring = deque(maxlen=max(size, self.limits.chunks + 1))
+        # absolute index of the next chunk to be put
+        self._head = 0
+        self._subscriptions = set()
+        self.finished = False
+        self.stopped = False
+
+        if streamer is None:
+            self.streamer = YouTubeStreamer(
+                YouTube(vid), queue=self, resolver=resolver
+            )
+        else:
+            # something else with start/stop that puts chunks to us, e.g. an
+            # encoder
+            self.streamer = streamer(self)
+
+    def start(self):
+        self.log.info('start:')
+        self.streamer.start()
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, preroll=1):
+        with self._cond:
+            # seed the new subscription with up to preroll of the most recent
+            # chunks so there's something to play right away and some buffer
+            # behind it
+            oldest = self._head - len(self._ring)
+            index = max(self._head - preroll, oldest)
+            subscription = Subscription(self, index)
+            self._subscriptions.add(subscription)
+        self.log.info(
+            'subscribe: subscribers=%d, preroll=%d',
+            self.subscribers,
+            self._head - index,
+        )
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._cond:
+            self._subscriptions.discard(subscription)
+            idle = not self._subscriptions
+        self.log.info('unsubscribe: subscribers=%d', self.subscribers)
+        if idle:
+            if self.on_idle:
+                self.on_idle(self)
+            else:
+                self.stop()
+
+    def stop(self):
+        self.log.info('stop:')
+        with self._cond:
+            self.stopped = True
+            # wake up anything waiting on us, e.g. a paused put
+            self._notify()
+        # nobody's listening, don't leave it fetching in the background
+        self.streamer.stop(join=True)
+
+    def _backlog(self, subscription):
+        # chunks and bytes subscription has yet to get
+        oldest = self._head - len(self._ring)
+        start = max(subscription.index - oldest, 0)
+        chunks = self._head - oldest - start
+        size = sum(self._ring[i].size for i in range(start, start + chunks))
+        return chunks, size
+
+    def _over(self, subscription, extra_chunks=0, extra_bytes=0):
+        chunks, size = self._backlog(subscription)
+        return (
+            chunks + extra_chunks > self.limits.chunks
+            or size + extra_bytes > self.limits.bytes
+        )
+
+    def _enforce(self):
+        # called with _cond held, after a chunk has been added
+        limits = self.limits
+        for subscription in list(self._subscriptions):
+            if not self._over(subscription):
+                continue
+            if limits.policy == limits.DISCONNECT:
+                self.log.warning('_enforce: disconnecting %s', subscription)
+                SLOW_CONSUMER.inc(vid=self.vid, action='disconnected')
+                subscription.disconnected = True
+                self._subscriptions.discard(subscription)
+                continue
+            dropped = 0
+            # always leave the newest chunk
+            while subscription.index < self._head - 1 and self._over(
+                subscription
+            ):
+                subscription.index += 1
+                dropped += 1
+            self.log.warning(
+                '_enforce: %s behind, dropped %d chunks', subscription, dropped
+            )
+            SLOW_CONSUMER.inc(dropped, vid=self.vid, action='dropped')
+
+    # queue-ish interface used by YouTubeStreamer
+
+    def put(self, chunk):
+        with self._cond:
+            if chunk is None:
+                self.finished = True
+                self._notify()
+                return
+
+            limits = self.limits
+            if limits.policy == limits.PAUSE:
+                # hold up the streamer until everyone has room for this chunk
+                def room():
+                    return self.stopped or not any(
+                        self._over(s, 1, chunk.size)
+                        for s in self._subscriptions
+                    )
+
+                if not room():
+                    self.log.info('put: pausing for slow subscription')
+                    SLOW_CONSUMER.inc(vid=self.vid, action='paused')
+                    if not self._cond.wait_for(room, limits.max_pause):
+                        self.log.warning('put: pause timed out')
+                        SLOW_CONSUMER.inc(vid=self.vid, action='pause_timeout')
+
+            self._ring.append(chunk)
+            self._head += 1
+            # anything still over, including a pause that timed out, gets
+            # handled per the policy
+            self._enforce()
+            self._notify()
+
+    def qsize(self):
+        # deepest subscription backlog
+        with self._cond:
+            if not self._subscriptions:
+                return 0
+            return self._head - min(s.index for s in self._subscriptions)
+
+    def _notify(self):
+        # called with _cond held
+        self._cond.notify_all()
+        self._async.notify()
+
+    def _ready(self, subscription):
+        return (
+            subscription.index < self._head
+            or subscription.disconnected
+            or self.finished
+        )
+
+    async def _aget(self, subscription, timeout):
+        if not await self._async.wait_for(
+            self._cond, lambda: self._ready(subscription), timeout
+        ):
+            raise Empty()
+        # there's something there now, won't block
+        return self._get(subscription, 0)
+
+    def _get(self, subscription, timeout):
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._ready(subscription), timeout
+            ):
+                raise Empty()
+            if subscription.disconnected or subscription.index >= self._head:
+                # disconnected, or finished and caught up
+                return None
+            oldest = self._head - len(self._ring)
+            if subscription.index < oldest:
+                self.log.warning(
+                    '_get: %s fell behind, skipping %d chunks',
+                    subscription,
+                    oldest - subscription.index,
+                )
+                subscription.index = oldest
+            chunk = self._ring[subscription.index - oldest]
+            subscription.index += 1
+            # there may be a paused put waiting on us to make room
+            self._notify()
+            return chunk
+
+    def __repr__(self):
+        return f'Broadcaster(vid={self.vid}, subscribers={self.subscribers}, head={self._head})'
+
+
+# Registry of Broadcasters keyed by video id so that every listener of the
+# same video shares one upstream fetch loop
+class Broadcasters:
+    log = getLogger('Broadcasters')
+
+    def __init__(
+        self, size=8, preroll=1, resolver=None, limits=None, streamer=None
+    ):
+        self.size = max(size, preroll)
+        self.preroll = preroll
+        self.resolver = resolver
+        self.limits = limits
+        # (vid, queue) -> streamer, for getting chunks from somewhere other
+        # than youtube directly, e.g. a hub
+        self.streamer = streamer
+        self._lock = Lock()
+        self._broadcasters = {}
+        # videos kept running whether or not anyone's listening
+        self._pinned = set()
+
+    def _broadcaster(self, vid):
+        # called with _lock held
+        broadcaster = self._broadcasters.get(vid)
+        if broadcaster is None or broadcaster.stopped or broadcaster.finished:
+            self.log.info('_broadcaster: new broadcaster, vid=%s', vid)
+            broadcaster = Broadcaster(
+                vid,
+                size=self.size,
+                on_idle=self._idle,
+                resolver=self.resolver,
+                limits=self.limits,
+                streamer=self._streamer(vid),
+            )
+            self._broadcasters[vid] = broadcaster
+            broadcaster.start()
+        return broadcaster
+
+    def subscribe(self, vid):
+        with self._lock:
+            return self._broadcaster(vid).subscribe(self.preroll)
+
+    def pin(self, vid):
+        # start vid, or restart it if it's stopped, and keep it going with no
+        # one listening
+        with self._lock:
+            self._pinned.add(vid)
+            return self._broadcaster(vid)
+
+    def unpin(self, vid):
+        with self._lock:
+            self._pinned.discard(vid)
+            broadcaster = self._broadcasters.get(vid)
+        if broadcaster is not None and not broadcaster.subscribers:
+            self._idle(broadcaster)
+
+    @property
+    def pinned(self):
+        return set(self._pinned)
+
+    def _streamer(self, vid):
+        if self.streamer is None:
+            return None
+        return lambda queue: self.streamer(vid, queue)
+
+    def _idle(self, broadcaster):
+        with self._lock:
+            if broadcaster.subscribers:
+                # someone joined while we were on our way here
+                return
+            if broadcaster.vid in self._pinned and not broadcaster.finished:
+                return
+            self.log.info('_idle: vid=%s', broadcaster.vid)
+            if self._broadcasters.get(broadcaster.vid) is broadcaster:
+                del self._broadcasters[broadcaster.vid]
+                # it's over for this video until someone asks again
+                SLOW_CONSUMER.remove(vid=broadcaster.vid)
+        # stopping joins the streamer, which can take a while, don't hold
+        # up everyone else's subscribes on it
+        broadcaster.stop()
+
+    def __len__(self):
+        return len(self._broadcasters)
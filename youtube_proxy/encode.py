@@ -0,0 +1,432 @@
+#
+#
+#
+
+from dataclasses import dataclass, field
+from importlib.util import find_spec
+from itertools import count
+from logging import getLogger
+from math import isfinite
+from multiprocessing import get_context
+from os import cpu_count
+from queue import Empty
+from struct import unpack_from
+from threading import Lock, Thread, current_thread
+
+from .broadcast import Broadcaster
+from .metrics import SLOW_CONSUMER
+
+# format -> (codec, container, mimetype, sample rate or None to keep the
+# source's)
+FORMATS = {
+    'mp3': ('libmp3lame', 'mp3', 'audio/mpeg', None),
+    'opus': ('libopus', 'ogg', 'audio/ogg', 48000),
+    'aac': ('aac', 'adts', 'audio/aac', None),
+}
+MIN_BITRATE = 8000
+MAX_BITRATE = 320000
+
+
+def available():
+    # av is a big import, and only needed in the workers, so just check that
+    # it's there
+    return find_spec('av') is not None
+
+
+def parse_bitrate(bitrate):
+    # 96k, 96000, etc.
+    bitrate = bitrate.strip().lower()
+    scale = 1
+    if bitrate.endswith('k'):
+        bitrate = bitrate[:-1]
+        scale = 1000
+    value = float(bitrate) * scale
+    if not isfinite(value):
+        raise ValueError(f'bitrate={bitrate} not finite')
+    value = int(value)
+    if not MIN_BITRATE <= value <= MAX_BITRATE:
+        raise ValueError(f'bitrate={value} out of range')
+    return value
+
+
+def _ogg_header_size(data):
+    # the leading pages that come before any audio, OpusHead and OpusTags,
+    # they've no granule position yet, 0 or -1 when no packet ends on them
+    offset = 0
+    while data[offset : offset + 4] == b'OggS' and offset + 27 <= len(data):
+        (granule,) = unpack_from('<q', data, offset + 6)
+        if granule > 0:
+            break
+        segments = data[offset + 26]
+        table = data[offset + 27 : offset + 27 + segments]
+        offset += 27 + segments + sum(table)
+    return min(offset, len(data))
+
+
+def _audio_specific_config(esds):
+    if esds is not None and esds.audio_specific_config:
+        return esds.audio_specific_config
+    # AAC-LC, 44.1kHz, stereo, what the ADTS path assumes too
+    return ((2 << 11) | (4 << 7) | (2 << 3)).to_bytes(2, 'big')
+
+
+class _Sink:
+    # write-only, without a seek muxers won't go back and rewrite headers in
+    # what we've already handed out
+    def __init__(self):
+        self.pieces = []
+
+    def write(self, data):
+        self.pieces.append(bytes(data))
+        return len(data)
+
+
+# Lives in a worker process, decodes AAC frames and re-encodes them for a
+# single rendition. Encoders keep state across calls so that segment
+# boundaries don't click.
+class _Session:
+    def __init__(self, _format, bitrate, audio_specific_config):
+        import av
+        from av.audio.fifo import AudioFifo
+
+        codec, container, _, rate = FORMATS[_format]
+
+        self.decoder = av.CodecContext.create('aac', 'r')
+        self.decoder.extradata = audio_specific_config
+
+        self.buf = _Sink()
+        self.container = av.open(self.buf, 'w', format=container)
+        self.codec = codec
+        self.rate = rate
+        self.bitrate = bitrate
+        self.stream = None
+        self.resampler = None
+        self.fifo = AudioFifo()
+        self.av = av
+
+    def _open(self, frame):
+        rate = self.rate or frame.sample_rate
+        self.stream = self.container.add_stream(self.codec, rate=rate)
+        ctx = self.stream.codec_context
+        ctx.bit_rate = self.bitrate
+        ctx.layout = 'stereo' if len(frame.layout.channels) > 1 else 'mono'
+        ctx.format = ctx.codec.audio_formats[0]
+        self.resampler = self.av.AudioResampler(
+            format=ctx.format, layout=ctx.layout, rate=rate
+        )
+
+    def _encode(self, frame):
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+
+    def _drain(self):
+        data = b''.join(self.buf.pieces)
+        self.buf.pieces.clear()
+        return data
+
+    def encode(self, frames):
+        for data in frames:
+            for frame in self.decoder.decode(self.av.Packet(data)):
+                if self.stream is None:
+                    self._open(frame)
+                for resampled in self.resampler.resample(frame):
+                    resampled.pts = None
+                    self.fifo.write(resampled)
+        if self.stream is not None:
+            # most encoders want exactly frame_size samples at a time
+            frame_size = self.stream.codec_context.frame_size or 1024
+            while self.fifo.samples >= frame_size:
+                self._encode(self.fifo.read(frame_size))
+        return self._drain()
+
+    def close(self):
+        if self.stream is not None:
+            if self.fifo.samples:
+                self._encode(self.fifo.read())
+            self._encode(None)
+        self.container.close()
+        return self._drain()
+
+
+def _serve(conn):
+    # worker process main loop, requests are (op, session_id, *args) and
+    # responses (ok, result)
+    sessions = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        op, session_id, *args = request
+        try:
+            if op == 'open':
+                sessions[session_id] = _Session(*args)
+                result = None
+            elif op == 'encode':
+                result = sessions[session_id].encode(*args)
+            elif op == 'close':
+                result = sessions.pop(session_id).close()
+            else:
+                raise ValueError(f'unknown op={op}')
+            conn.send((True, result))
+        except Exception as e:
+            sessions.pop(session_id, None)
+            conn.send((False, f'{type(e).__name__}: {e}'))
+
+
+class EncodeError(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, ctx, index):
+        self.log = getLogger(f'EncoderPool.worker[{index}]')
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_serve,
+            args=(child,),
+            name=f'EncoderPool.worker[{index}]',
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.log.info('__init__: pid=%d', self.process.pid)
+        # a worker does one thing at a time, callers take turns
+        self._lock = Lock()
+        self.sessions = 0
+
+    @property
+    def alive(self):
+        return self.process.is_alive()
+
+    def call(self, *request):
+        with self._lock:
+            try:
+                self.conn.send(request)
+                ok, result = self.conn.recv()
+            except (EOFError, OSError) as e:
+                raise EncodeError(f'worker gone, e={e}')
+        if not ok:
+            raise EncodeError(result)
+        return result
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+
+
+class _PooledSession:
+    def __init__(self, pool, worker, session_id):
+        self.pool = pool
+        self.worker = worker
+        self.session_id = session_id
+
+    def encode(self, frames):
+        return self.worker.call('encode', self.session_id, frames)
+
+    def close(self):
+        try:
+            return self.worker.call('close', self.session_id)
+        finally:
+            self.pool._release(self.worker)
+
+
+# A fixed number of worker processes that encoding sessions are spread over,
+# each session sticks to its worker since encoders are stateful. Processes are
+# spawned on first use.
+class EncoderPool:
+    log = getLogger('EncoderPool')
+
+    def __init__(self, workers=None):
+        self.size = workers or cpu_count() or 1
+        self.log.info('__init__: workers=%d', self.size)
+        self._ctx = get_context('spawn')
+        self._lock = Lock()
+        self._workers = []
+        self._session_ids = count()
+
+    def _worker(self):
+        with self._lock:
+            # replace anything that's died
+            self._workers = [w for w in self._workers if w.alive]
+            if len(self._workers) < self.size:
+                worker = _Worker(self._ctx, len(self._workers))
+                self._workers.append(worker)
+            else:
+                worker = min(self._workers, key=lambda w: w.sessions)
+            worker.sessions += 1
+            return worker
+
+    def _release(self, worker):
+        with self._lock:
+            worker.sessions -= 1
+
+    def open(self, _format, bitrate, audio_specific_config):
+        worker = self._worker()
+        session_id = next(self._session_ids)
+        try:
+            worker.call(
+                'open', session_id, _format, bitrate, audio_specific_config
+            )
+        except Exception:
+            self._release(worker)
+            raise
+        return _PooledSession(self, worker, session_id)
+
+    def stop(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+
+@dataclass(order=True)
+class _Encoded:
+    seq_num: int
+    content: bytes = field(compare=False)
+    # what a decoder needs ahead of anything else, e.g. Ogg's OpusHead and
+    # OpusTags pages, for listeners that join part way through
+    header: bytes = field(compare=False, default=None)
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def __repr__(self):
+        return f'Encoded(seq_num={self.seq_num}, size={self.size})'
+
+
+# Stands in for a YouTubeStreamer on a Broadcaster, it listens to the source
+# video's broadcast, has each chunk re-encoded by the pool, and puts the
+# results so that every listener of the rendition shares them
+class _Encoder(Thread):
+    def __init__(self, name, source, pool, _format, bitrate, queue):
+        super().__init__(name=f'Encoder[{name}]', daemon=True)
+        self.log = getLogger(f'Encoder[{name}]')
+        self.source = source
+        self.pool = pool
+        self.format = _format
+        self.bitrate = bitrate
+        self.queue = queue
+        self.running = False
+        self.header = None
+
+    def start(self):
+        self.log.info('start: ')
+        self.running = True
+        super().start()
+
+    def stop(self, join=False, timeout=5.0):
+        self.log.info('stop: join=%s', join)
+        self.running = False
+        if join and self.is_alive() and self is not current_thread():
+            self.join(timeout)
+
+    def _put(self, seq_num, data):
+        if self.header is None and FORMATS[self.format][1] == 'ogg':
+            # only the first output has the header pages, keep them to hand
+            # to everyone who joins later
+            size = _ogg_header_size(data)
+            self.header = data[:size]
+            data = data[size:]
+        if data:
+            self.queue.put(_Encoded(seq_num, data, self.header))
+
+    def run(self):
+        session = None
+        seq_num = None
+        try:
+            while self.running:
+                try:
+                    chunk = self.source.get(timeout=1)
+                except Empty:
+                    continue
+                if chunk is None:
+                    break
+                frames = [bytes(f) for batch in chunk.batches() for f in batch]
+                if session is None:
+                    # moov's been parsed now that the frames are here
+                    session = self.pool.open(
+                        self.format,
+                        self.bitrate,
+                        _audio_specific_config(chunk.esds),
+                    )
+                data = session.encode(frames)
+                seq_num = chunk.seq_num
+                if data:
+                    self._put(seq_num, data)
+            if session is not None:
+                data = session.close()
+                session = None
+                if data:
+                    self._put(seq_num, data)
+        except Exception:
+            self.log.exception('run: failed')
+            if session is not None:
+                try:
+                    session.close()
+                except Exception:
+                    pass
+        finally:
+            self.log.info('run: exiting')
+            self.source.close()
+            self.queue.put(None)
+
+
+# Registry of re-encoded renditions keyed by (vid, format, bitrate), each is a
+# Broadcaster fed by an _Encoder listening to the source video's broadcast
+class Renditions:
+    log = getLogger('Renditions')
+
+    def __init__(self, broadcasters, pool, preroll=1, limits=None):
+        self.broadcasters = broadcasters
+        self.pool = pool
+        self.preroll = preroll
+        self.limits = limits
+        self._lock = Lock()
+        self._renditions = {}
+
+    def subscribe(self, vid, _format, bitrate):
+        key = (vid, _format, bitrate)
+        with self._lock:
+            broadcaster = self._renditions.get(key)
+            if (
+                broadcaster is None
+                or broadcaster.stopped
+                or broadcaster.finished
+            ):
+                name = f'{vid}:{_format}:{bitrate}'
+                self.log.info('subscribe: new rendition, %s', name)
+                broadcaster = Broadcaster(
+                    name,
+                    size=max(8, self.preroll),
+                    on_idle=self._idle,
+                    limits=self.limits,
+                    streamer=lambda queue: _Encoder(
+                        name,
+                        self.broadcasters.subscribe(vid),
+                        self.pool,
+                        _format,
+                        bitrate,
+                        queue,
+                    ),
+                )
+                broadcaster.key = key
+                self._renditions[key] = broadcaster
+                broadcaster.start()
+            return broadcaster.subscribe(self.preroll)
+
+    def _idle(self, broadcaster):
+        with self._lock:
+            if broadcaster.subscribers:
+                return
+            if self._renditions.get(broadcaster.key) is broadcaster:
+                del self._renditions[broadcaster.key]
+                SLOW_CONSUMER.remove(vid=broadcaster.vid)
+        self.log.info('_idle: %s', broadcaster.vid)
+        broadcaster.stop()
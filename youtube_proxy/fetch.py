@@ -0,0 +1,146 @@
+#
+#
+#
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logging import getLogger
+from random import uniform
+from threading import Event
+from time import time
+
+from requests import RequestException
+
+from .session import get_session
+
+# hedged requests run on a shared pool so that a slow first attempt doesn't
+# block the streamer thread from firing a second
+_executor = ThreadPoolExecutor(
+    max_workers=32, thread_name_prefix='HedgedFetcher'
+)
+
+
+class RetryableStatus(RequestException):
+    pass
+
+
+class HedgedFetcher:
+    # statuses worth trying again, everything else is handed back as is
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        name,
+        timeout,
+        retries=3,
+        backoff=0.1,
+        hedge_after=None,
+        hedge_percentile=0.95,
+        min_hedge_after=0.1,
+        window=100,
+        cancelled=None,
+        hedge=True,
+    ):
+        self.log = getLogger(f'HedgedFetcher[{name}]')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # fixed hedge threshold, otherwise it's hedge_percentile of what we've
+        # been seeing
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_after = min_hedge_after
+        # off, attempts are plain gets on the caller's thread, nothing goes
+        # on the shared pool
+        self.hedge = hedge
+        # an Event that, once set, stops any further attempts
+        self.cancelled = cancelled or Event()
+
+        self._latencies = deque(maxlen=window)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retried = 0
+
+    @property
+    def hedge_threshold(self):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self._latencies) < 10:
+            # not enough to go on yet, don't hedge until we're halfway to
+            # timing out
+            return self.timeout / 2
+        latencies = sorted(self._latencies)
+        threshold = latencies[int(len(latencies) * self.hedge_percentile)]
+        return min(max(threshold, self.min_hedge_after), self.timeout)
+
+    def _get(self, url, stream, headers=None):
+        start = time()
+        resp = get_session().get(
+            url, timeout=self.timeout, stream=stream, headers=headers
+        )
+        if resp.status_code in self.RETRY_STATUSES:
+            resp.close()
+            raise RetryableStatus(f'status={resp.status_code}', response=resp)
+        self._latencies.append(time() - start)
+        return resp
+
+    def _hedged(self, url, stream, headers):
+        threshold = self.hedge_threshold
+        first = _executor.submit(self._get, url, stream, headers)
+        done, _ = wait((first,), timeout=threshold)
+        if done:
+            return first.result()
+
+        self.log.debug('_hedged: slow, hedging after=%f', threshold)
+        self.hedges += 1
+        second = _executor.submit(self._get, url, stream, headers)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    resp = future.result()
+                except RequestException as e:
+                    error = e
+                    continue
+                if future is second:
+                    self.hedge_wins += 1
+                for loser in pending:
+                    # release the connection of whichever comes in second
+                    loser.add_done_callback(_close)
+                return resp
+        raise error
+
+    def get(self, url, deadline=None, stream=False, headers=None):
+        # deadline is an absolute time() past which we won't start another
+        # attempt. when streaming, retries and hedging only cover getting the
+        # response headers, the body is up to the caller
+        attempt = 0
+        while True:
+            try:
+                if not self.hedge:
+                    return self._get(url, stream, headers)
+                return self._hedged(url, stream, headers)
+            except RequestException as e:
+                if attempt >= self.retries:
+                    raise
+                # exponential backoff with jitter so that a fleet of streamers
+                # doesn't retry in lock step
+                delay = self.backoff * 2**attempt * uniform(0.5, 1.5)
+                if deadline is not None and time() + delay > deadline:
+                    raise
+                attempt += 1
+                self.retried += 1
+                self.log.warning(
+                    'get: failed, attempt=%d, delay=%f, e=%s', attempt, delay, e
+                )
+                if self.cancelled.wait(delay):
+                    raise
+
+
+def _close(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
@@ -0,0 +1,272 @@
+#
+#
+#
+
+from collections import OrderedDict, deque
+from logging import getLogger
+from math import ceil
+from queue import Empty
+from struct import pack, unpack_from
+from threading import Condition, Lock, Thread
+from time import time
+
+from .metrics import HLS_CACHE, HLS_CACHE_BYTES
+
+AAC = 'aac'
+FMP4 = 'fmp4'
+CONTAINERS = (AAC, FMP4)
+
+
+# An LRU of packaged segments bounded by total size and age, keyed by
+# (vid, name). Segments never change once written so anything in here can be
+# handed out as is.
+class SegmentCache:
+    log = getLogger('SegmentCache')
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60.0):
+        self.log.info('__init__: max_bytes=%d, ttl=%f', max_bytes, ttl)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = Lock()
+        # key -> (expires_at, data)
+        self._entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires_at, data = self._entries[key]
+            except KeyError:
+                HLS_CACHE.inc(result='miss')
+                return None
+            if expires_at <= time():
+                self._remove(key)
+                HLS_CACHE.inc(result='expired')
+                return None
+            self._entries.move_to_end(key)
+        HLS_CACHE.inc(result='hit')
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            self.log.warning('put: key=%s too big, size=%d', key, len(data))
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time() + self.ttl, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                HLS_CACHE.inc(result='evicted')
+            HLS_CACHE_BYTES.set(self.size)
+
+    def _remove(self, key):
+        _, data = self._entries.pop(key)
+        self.size -= len(data)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def split_init(content):
+    # youtube's segments carry their own ftyp & moov, everything up to the
+    # first moof is the initialization section and the rest is the media
+    offset = 0
+    end = len(content)
+    while offset + 8 <= end:
+        size, _type = unpack_from('>I4s', content, offset)
+        if _type == b'moof':
+            break
+        if size < 8:
+            # 0 runs to the end, anything else is garbage, either way there's
+            # no moof
+            break
+        offset += size
+    return content[:offset], content[offset:]
+
+
+def _syncsafe(n):
+    # ID3's 28-bit sizes, 7 bits to a byte
+    return bytes(
+        ((n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F)
+    )
+
+
+def id3_timestamp(seconds):
+    # the ID3 tag packed audio segments have to start with, RFC 8216 3.4, a
+    # PRIV frame with the first frame's 33-bit 90kHz MPEG-2 timestamp
+    payload = b'com.apple.streaming.transportStreamTimestamp\x00' + pack(
+        '>Q', int(round(seconds * 90000)) & ((1 << 33) - 1)
+    )
+    frame = b'PRIV' + _syncsafe(len(payload)) + b'\x00\x00' + payload
+    return b'ID3\x04\x00\x00' + _syncsafe(len(frame)) + frame
+
+
+# A listener on a Broadcaster that packages each chunk, once it's complete,
+# into cached segments and keeps a sliding window of them for the playlist.
+# It runs for as long as someone keeps asking for the playlist.
+class _Recorder(Thread):
+    def __init__(
+        self, vid, subscription, cache, window, idle_after, on_exit=None
+    ):
+        super().__init__(name=f'Recorder[{vid}]', daemon=True)
+        self.log = getLogger(f'Recorder[{vid}]')
+        self.vid = vid
+        self.subscription = subscription
+        self.cache = cache
+        self.idle_after = idle_after
+        self.on_exit = on_exit
+
+        self._cond = Condition()
+        # (seq_num, duration) of what's currently in the playlist
+        self.segments = deque(maxlen=window)
+        # media time the next segment starts at, for ones without a tfdt
+        self._next_time = 0.0
+        self.finished = False
+        self.last_requested = time()
+
+    def touch(self):
+        self.last_requested = time()
+
+    @property
+    def idle(self):
+        return time() - self.last_requested > self.idle_after
+
+    def run(self):
+        self.log.info('run: ')
+        try:
+            while not self.idle:
+                try:
+                    chunk = self.subscription.get(timeout=self.idle_after)
+                except Empty:
+                    continue
+                if chunk is None:
+                    break
+                self._package(chunk)
+        except Exception:
+            self.log.exception('run: failed')
+        finally:
+            self.log.info('run: exiting, idle=%s', self.idle)
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            self.subscription.close()
+            if self.on_exit:
+                self.on_exit(self)
+
+    def _package(self, chunk):
+        # waits on the rest of a still downloading chunk
+        pieces = list(chunk.adts())
+        frames = sum(len(offsets) - 1 for _, offsets in pieces)
+        if not frames:
+            self.log.warning('_package: chunk=%s has no frames', chunk)
+            return
+        try:
+            duration = chunk.mp4.duration
+        except StopIteration:
+            duration = None
+        if not duration:
+            # no moof to go on, assume the frames are 1024 samples a piece
+            duration = frames * 1024 / 44100
+        try:
+            start = chunk.mp4.time
+        except StopIteration:
+            # carry on from the last one
+            start = self._next_time
+        self._next_time = start + duration
+
+        self.cache.put(
+            (self.vid, f'{chunk.seq_num}.aac'),
+            id3_timestamp(start) + b''.join(audio for audio, _ in pieces),
+        )
+        content = b''.join(chunk.data())
+        if content:
+            init, media = split_init(content)
+            if init:
+                self.cache.put((self.vid, 'init.mp4'), init)
+            self.cache.put((self.vid, f'{chunk.seq_num}.mp4'), media)
+
+        with self._cond:
+            self.segments.append((chunk.seq_num, duration))
+            self._cond.notify_all()
+        self.log.debug(
+            '_package: seq_num=%d, duration=%f', chunk.seq_num, duration
+        )
+
+    def wait(self, timeout):
+        # until there's at least one segment to list
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.segments or self.finished, timeout=timeout
+            )
+            return list(self.segments)
+
+    def playlist(self, container, timeout=10.0):
+        segments = self.wait(timeout)
+        if not segments:
+            return None
+
+        ext = 'mp4' if container == FMP4 else 'aac'
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:7' if container == FMP4 else '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{ceil(max(d for _, d in segments))}',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0][0]}',
+        ]
+        if container == FMP4:
+            lines.append('#EXT-X-MAP:URI="init.mp4"')
+        for seq_num, duration in segments:
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(f'{seq_num}.{ext}')
+        if self.finished:
+            lines.append('#EXT-X-ENDLIST')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+# Re-serves what the Broadcasters fetch as HLS, a playlist per video with its
+# segments coming out of a shared SegmentCache
+class HlsPackager:
+    log = getLogger('HlsPackager')
+
+    def __init__(self, broadcasters, cache, window=6, idle_after=30.0):
+        self.log.info('__init__: window=%d, idle_after=%f', window, idle_after)
+        self.broadcasters = broadcasters
+        self.cache = cache
+        self.window = window
+        self.idle_after = idle_after
+
+        self._lock = Lock()
+        self._recorders = {}
+
+    def recorder(self, vid):
+        with self._lock:
+            recorder = self._recorders.get(vid)
+            if recorder is None or recorder.finished:
+                self.log.info('recorder: new recorder, vid=%s', vid)
+                recorder = _Recorder(
+                    vid,
+                    self.broadcasters.subscribe(vid),
+                    self.cache,
+                    self.window,
+                    self.idle_after,
+                    on_exit=self._exited,
+                )
+                self._recorders[vid] = recorder
+                recorder.start()
+            recorder.touch()
+            return recorder
+
+    def _exited(self, recorder):
+        with self._lock:
+            if self._recorders.get(recorder.vid) is recorder:
+                del self._recorders[recorder.vid]
+
+    def playlist(self, vid, container=AAC):
+        return self.recorder(vid).playlist(container)
+
+    def segment(self, vid, name):
+        return self.cache.get((vid, name))
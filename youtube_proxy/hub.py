@@ -0,0 +1,267 @@
+#
+#
+#
+
+from dataclasses import asdict
+from json import dumps, loads
+from logging import getLogger
+from os import environ, unlink
+from queue import Empty
+from socket import AF_UNIX, SHUT_RDWR, SOCK_STREAM, socket
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from struct import Struct
+from threading import Lock, Thread, current_thread
+from time import time
+
+from .youtube import YouTube, _Resolved, _StreamingChunk
+
+# Everything on the wire is a message, a header of type & payload length
+# followed by the payload. A subscriber sends the video id followed by a
+# newline, the hub then sends START, any number of DATA, and END for each
+# chunk, and EOF when the stream is over. Sending resolve and the video id
+# instead gets a single RESOLVED, the hub's resolution of it as json, or
+# ERROR.
+_HEADER = Struct('>BI')
+# seq_num, seen_at, head_seq_num (-1 for none)
+_START = Struct('>qdq')
+START = 1
+DATA = 2
+END = 3
+EOF = 4
+RESOLVED = 5
+ERROR = 6
+
+
+class HubError(Exception):
+    pass
+
+
+def _send(sock, _type, payload=b''):
+    sock.sendall(_HEADER.pack(_type, len(payload)))
+    if payload:
+        sock.sendall(payload)
+
+
+class _Handler(StreamRequestHandler):
+    def handle(self):
+        request = self.rfile.readline().decode('ascii').split()
+        if len(request) == 2 and request[0] == 'resolve':
+            return self._resolve(request[1])
+        if not request:
+            # nothing to subscribe to, returning closes the connection
+            getLogger('Hub').warning('handle: empty request')
+            return
+        vid = request[0]
+        log = getLogger(f'Hub[{vid}]')
+        log.info('handle: subscriber')
+        subscription = self.server.broadcasters.subscribe(vid)
+        sock = self.connection
+
+        def watch():
+            # subscribers never send anything else, so a read returning is
+            # them hanging up, let go of the stream right away rather than
+            # when our next send fails
+            self.rfile.read()
+            log.info('handle: subscriber hung up')
+            subscription.close()
+
+        Thread(target=watch, name=f'Hub[{vid}].watch', daemon=True).start()
+        try:
+            while True:
+                try:
+                    chunk = subscription.get(timeout=30)
+                except Empty:
+                    continue
+                if chunk is None:
+                    _send(sock, EOF)
+                    break
+                head_seq_num = chunk.head_seq_num
+                _send(
+                    sock,
+                    START,
+                    _START.pack(
+                        chunk.seq_num,
+                        chunk.seen_at,
+                        -1 if head_seq_num is None else head_seq_num,
+                    ),
+                )
+                # raw body as it lands so the subscriber can start on the
+                # frames before the segment's done downloading
+                for data in chunk.data():
+                    _send(sock, DATA, data)
+                _send(sock, END)
+        except OSError as e:
+            log.info('handle: subscriber gone, e=%s', e)
+        finally:
+            subscription.close()
+
+    def _resolve(self, vid):
+        try:
+            resolved = self.server.resolver.resolve(YouTube(vid))
+        except Exception as e:
+            getLogger(f'Hub[{vid}]').exception('_resolve: failed')
+            _send(self.connection, ERROR, str(e).encode('utf-8'))
+            return
+        _send(self.connection, RESOLVED, dumps(asdict(resolved)).encode())
+
+
+# Owns the upstream YouTubeStreamers for a set of worker processes. Each worker
+# subscribes over a unix socket and gets the raw chunks to re-parse and fan
+# out to its own listeners, so there's one upstream fetch per video no matter
+# how many workers are serving it.
+class Hub(ThreadingUnixStreamServer):
+    log = getLogger('Hub')
+    daemon_threads = True
+
+    def __init__(self, path, broadcasters):
+        self.log.info('__init__: path=%s', path)
+        try:
+            # left over from a previous run
+            unlink(path)
+        except FileNotFoundError:
+            pass
+        self.path = path
+        self.broadcasters = broadcasters
+        self.resolver = broadcasters.resolver
+        super().__init__(path, _Handler)
+
+
+# Stands in for a StreamResolver in a worker. It asks the hub, so each video is
+# resolved once, by the hub's resolver, for every worker, and caches what comes
+# back until the url expires.
+class HubResolver:
+    log = getLogger('HubResolver')
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._lock = Lock()
+        self._resolved = {}
+
+    def _ask(self, vid):
+        with socket(AF_UNIX, SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            sock.sendall(f'resolve {vid}\n'.encode('ascii'))
+            rfile = sock.makefile('rb')
+            header = rfile.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise HubError('hub went away')
+            _type, length = _HEADER.unpack(header)
+            payload = rfile.read(length)
+        if _type != RESOLVED:
+            raise HubError(payload.decode('utf-8', 'replace'))
+        return _Resolved(**loads(payload))
+
+    def resolve(self, youtube):
+        with self._lock:
+            resolved = self._resolved.get(youtube.id)
+        if resolved is None or resolved.expires_at <= time():
+            resolved = self._ask(youtube.id)
+            self.log.info('resolve: vid=%s, resolved=%s', youtube.id, resolved)
+            with self._lock:
+                self._resolved[youtube.id] = resolved
+        return resolved
+
+    def invalidate(self, vid):
+        with self._lock:
+            self._resolved.pop(vid, None)
+
+
+# Stands in for a YouTubeStreamer on a worker's Broadcaster, it subscribes to
+# the hub and puts what comes back as _StreamingChunks
+class HubStreamer(Thread):
+    def __init__(self, path, vid, queue):
+        super().__init__(name=f'HubStreamer[{vid}]', daemon=True)
+        self.log = getLogger(f'HubStreamer[{vid}]')
+        self.path = path
+        self.vid = vid
+        self.queue = queue
+        self.running = False
+        self.started_at = self.last_active = None
+        self._sock = None
+
+    def start(self):
+        self.log.info('start: ')
+        self.running = True
+        self.started_at = self.last_active = time()
+        super().start()
+
+    def stop(self, join=False, timeout=5.0):
+        self.log.info('stop: join=%s', join)
+        self.running = False
+        sock = self._sock
+        if sock is not None:
+            # wakes run up from a blocking read
+            try:
+                sock.shutdown(SHUT_RDWR)
+            except OSError:
+                pass
+        if join and self.is_alive() and self is not current_thread():
+            self.join(timeout)
+
+    def run(self):
+        chunk = None
+        try:
+            self._sock = socket(AF_UNIX, SOCK_STREAM)
+            self._sock.connect(self.path)
+            self._sock.sendall(f'{self.vid}\n'.encode('ascii'))
+            rfile = self._sock.makefile('rb')
+            while self.running:
+                header = rfile.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    if self.running:
+                        self.log.warning('run: hub went away')
+                    break
+                _type, length = _HEADER.unpack(header)
+                payload = rfile.read(length) if length else b''
+                if _type == START:
+                    seq_num, seen_at, head_seq_num = _START.unpack(payload)
+                    chunk = _StreamingChunk(
+                        seq_num=seq_num,
+                        seen_at=seen_at,
+                        content=None,
+                        head_seq_num=None if head_seq_num < 0 else head_seq_num,
+                    )
+                    self.last_active = time()
+                    self.queue.put(chunk)
+                elif _type == DATA:
+                    chunk.feed(payload)
+                elif _type == END:
+                    chunk.finish()
+                    chunk = None
+                elif _type == EOF:
+                    self.log.info('run: stream over')
+                    break
+        except OSError as e:
+            if self.running:
+                self.log.warning('run: failed, e=%s', e)
+        finally:
+            self.log.info('run: exiting')
+            if chunk is not None:
+                # don't leave listeners waiting on the rest of it
+                chunk.finish()
+            if self._sock is not None:
+                self._sock.close()
+            self.queue.put(None)
+
+
+def hub_streamer(path):
+    # a Broadcasters streamer factory
+    return lambda vid, queue: HubStreamer(path, vid, queue)
+
+
+def main():
+    from . import upstream
+
+    path = environ.get('HUB_SOCKET', '/tmp/youtube-proxy.sock')
+    hub = Hub(path, upstream())
+    try:
+        hub.serve_forever()
+    finally:
+        hub.server_close()
+        unlink(path)
+
+
+if __name__ == '__main__':
+    main()
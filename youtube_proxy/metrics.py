@@ -0,0 +1,213 @@
+#
+#
+#
+
+from bisect import bisect_left
+from io import StringIO
+from threading import Lock
+
+
+class _Metric:
+    _type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def remove(self, **labels):
+        # drop every label set matching labels, e.g. all of a stream's when it
+        # goes away, so that series don't pile up forever
+        match = [(self.labelnames.index(n), str(v)) for n, v in labels.items()]
+        with self._lock:
+            for key in [
+                k for k in self._values if all(k[i] == v for i, v in match)
+            ]:
+                del self._values[key]
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        labels = ','.join(f'{n}="{_escape(v)}"' for n, v in pairs)
+        return f'{{{labels}}}'
+
+    def _samples(self):
+        raise NotImplementedError()
+
+    def render(self, buf):
+        buf.write(f'# HELP {self.name} {self.documentation}\n')
+        buf.write(f'# TYPE {self.name} {self._type}\n')
+        for name, labels, value in self._samples():
+            buf.write(f'{name}{labels} {_number(value)}\n')
+
+
+class Counter(_Metric):
+    _type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, self._labels(key), value
+
+
+class Gauge(_Metric):
+    _type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, self._labels(key), value
+
+
+class Histogram(_Metric):
+    _type = 'histogram'
+
+    DEFAULT_BUCKETS = (
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            try:
+                counts, total = self._values[key]
+            except KeyError:
+                # one count per bucket plus +Inf
+                counts = [0] * (len(self.buckets) + 1)
+                total = 0.0
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        with self._lock:
+            values = [(k, list(c), t) for k, (c, t) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for le, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket',
+                    self._labels(key, (('le', le),)),
+                    cumulative,
+                )
+            yield f'{self.name}_sum', self._labels(key), total
+            yield f'{self.name}_count', self._labels(key), cumulative
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = []
+
+
+def render():
+    buf = StringIO()
+    for metric in REGISTRY:
+        metric.render(buf)
+    return buf.getvalue()
+
+
+ACTIVE_STREAMERS = Gauge(
+    'youtube_proxy_active_streamers', 'Running upstream YouTubeStreamers'
+)
+FETCH_LATENCY = Histogram(
+    'youtube_proxy_fetch_latency_seconds',
+    'Upstream segment fetch latency, including retries and hedging',
+    ('vid',),
+)
+FETCHES = Counter(
+    'youtube_proxy_fetches_total',
+    'Upstream segment fetches by outcome, new, duplicate, not_ready, or error',
+    ('vid', 'result'),
+)
+VOD_PIECES = Counter(
+    'youtube_proxy_vod_pieces_total', 'Byte range pieces fetched for VOD'
+)
+QUEUE_DEPTH = Gauge(
+    'youtube_proxy_queue_depth',
+    'Chunks waiting on the furthest behind consumer of a stream',
+    ('vid',),
+)
+SLOW_CONSUMER = Counter(
+    'youtube_proxy_slow_consumer_total',
+    'Slow consumer policy decisions, dropped chunks, paused, pause_timeout, '
+    'or disconnected',
+    ('vid', 'action'),
+)
+EMITTED_BYTES = Counter(
+    'youtube_proxy_emitted_bytes_total', 'ADTS bytes yielded to listeners'
+)
+EMITTED_FRAMES = Counter(
+    'youtube_proxy_emitted_frames_total', 'AAC frames yielded to listeners'
+)
+MP4_PARSE = Histogram(
+    'youtube_proxy_mp4_parse_seconds',
+    'Time spent parsing segments into Mp4s',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1),
+)
+HLS_CACHE = Counter(
+    'youtube_proxy_hls_cache_total',
+    'HLS segment cache lookups and evictions, hit, miss, expired, or evicted',
+    ('result',),
+)
+HLS_CACHE_BYTES = Gauge(
+    'youtube_proxy_hls_cache_bytes', 'Size of the HLS segments currently cached'
+)
+PACING = Counter(
+    'youtube_proxy_pacing_reanchors_total',
+    'Times a listener\'s pacing clock was reset, start, discontinuity, or '
+    'behind',
+    ('action',),
+)
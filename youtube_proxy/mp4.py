@@ -2,8 +2,19 @@
 #
 #
 
+from array import array
+from bisect import bisect_right
+from collections import deque
 from io import StringIO
+from itertools import accumulate, repeat
 from logging import getLogger
+from struct import unpack_from
+from sys import byteorder
+
+# array typecodes for 32-bit values, 'I'/'i' are 4 bytes on everything we
+# run on, but fall back to 'L'/'l' just in case
+_UINT32 = 'I' if array('I').itemsize == 4 else 'L'
+_INT32 = 'i' if array('i').itemsize == 4 else 'l'
 
 
 class Box:
@@ -35,8 +46,9 @@ class Box:
 class FullBox(Box):
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        self.version = int(data[0])
-        self.flags = int.from_bytes(data[1:4], 'big')
+        (version_flags,) = unpack_from('>I', data)
+        self.version = version_flags >> 24
+        self.flags = version_flags & 0xFFFFFF
 
     def __repr__(self, prefix=''):
         return f'{super().__repr__(prefix)} version={self.version} flags={self.flags:06x}'
@@ -47,13 +59,11 @@ class FileTypeBox(Box):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        self.major_brand = data[0:4].decode('ascii')
-        self.minor_version = int.from_bytes(data[4:8], 'big')
-        data = data[8:]
-        self.compatible_brands = []
-        while data:
-            self.compatible_brands.append(data[:4].decode('ascii'))
-            data = data[4:]
+        major_brand, self.minor_version = unpack_from('>4sI', data)
+        self.major_brand = major_brand.decode('ascii')
+        self.compatible_brands = [
+            str(data[i : i + 4], 'ascii') for i in range(8, len(data), 4)
+        ]
 
     def __repr__(self, prefix=''):
         compatible_brands = f'\n{prefix} - compatibleBrand: '.join(
@@ -67,13 +77,49 @@ class FileTypeBox(Box):
 
 class _ContainerMixin:
     def __init__(self, data):
-        self.boxes = box_up(data)
+        # only the box headers are read up front, each box is built the first
+        # time something asks for it
+        self._data, entries = box_index(data)
+        self._index(entries, [_UNBUILT] * len(entries))
+
+    def _index(self, entries, built):
+        self._entries = entries
+        self._built = built
+        self._types = {}
+        for i, (_type, *_) in enumerate(entries):
+            self._types.setdefault(_type, []).append(i)
+
+    def _box(self, i):
+        box = self._built[i]
+        if box is _UNBUILT:
+            _type, size, offset, header = self._entries[i]
+            box = Box.new(
+                size, _type, self._data[offset + header : offset + size]
+            )
+            self._built[i] = box
+        return box
+
+    @property
+    def boxes(self):
+        boxes = (self._box(i) for i in range(len(self._entries)))
+        return [b for b in boxes if b is not None]
 
     def get(self, _type):
-        for box in self.boxes:
-            if box._type == _type:
+        for i in self._types.get(_type, ()):
+            box = self._box(i)
+            if box is not None:
                 yield box
 
+    def find(self, _type, *path):
+        # walk down through the path of types, first match wins
+        for box in self.get(_type):
+            if not path:
+                return box
+            found = box.find(*path)
+            if found is not None:
+                return found
+        return None
+
 
 class ContainerBox(_ContainerMixin, Box):
     def __init__(self, size, _type, data):
@@ -97,16 +143,14 @@ class MovieHeaderBox(FullBox):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        # TODO: kind of annoying they'll all have to do this...
-        data = data[4:]
-        word_size = 8 if self.version == 1 else 4
-        self.creation_time = int.from_bytes(data[:word_size], 'big')
-        data = data[word_size:]
-        self.modification_time = int.from_bytes(data[:word_size], 'big')
-        data = data[word_size:]
-        self.timescale = int.from_bytes(data[:word_size], 'big')
-        data = data[word_size:]
-        self.duration = int.from_bytes(data[:word_size], 'big')
+        # timescale is always 32-bit, the rest grow to 64-bit in version 1
+        fmt = '>QQIQ' if self.version == 1 else '>IIII'
+        (
+            self.creation_time,
+            self.modification_time,
+            self.timescale,
+            self.duration,
+        ) = unpack_from(fmt, data, 4)
 
     def __repr__(self, prefix=''):
         return f'''{super().__repr__(prefix)}
@@ -120,14 +164,267 @@ class MovieExtendsBox(ContainerBox):
     _type = 'mvex'
 
 
-class TrackExtendsBox(Box):
+class TrackExtendsBox(FullBox):
     _type = 'trex'
 
+    def __init__(self, size, _type, data):
+        super().__init__(size, _type, data)
+        (
+            self.track_id,
+            self.default_sample_description_index,
+            self.default_sample_duration,
+            self.default_sample_size,
+            self.default_sample_flags,
+        ) = unpack_from('>IIIII', data, 4)
 
-class TrackBox(Box):
+    def __repr__(self, prefix=''):
+        return f'''{super().__repr__(prefix)}
+{prefix} - trackId: {self.track_id}
+{prefix} - defaultSampleDuration: {self.default_sample_duration}
+{prefix} - defaultSampleSize: {self.default_sample_size}'''
+
+
+class TrackBox(ContainerBox):
     _type = 'trak'
 
 
+class TrackHeaderBox(Box):
+    _type = 'tkhd'
+
+
+class EditBox(Box):
+    _type = 'edts'
+
+
+class MediaBox(ContainerBox):
+    _type = 'mdia'
+
+
+class MediaHeaderBox(FullBox):
+    _type = 'mdhd'
+
+    def __init__(self, size, _type, data):
+        super().__init__(size, _type, data)
+        # same layout as mvhd's start, tfdt and trun are in this timescale
+        fmt = '>QQIQ' if self.version == 1 else '>IIII'
+        (
+            self.creation_time,
+            self.modification_time,
+            self.timescale,
+            self.duration,
+        ) = unpack_from(fmt, data, 4)
+
+    def __repr__(self, prefix=''):
+        return f'''{super().__repr__(prefix)}
+{prefix} - timeScale: {self.timescale}
+{prefix} - duration: {self.duration}'''
+
+
+class HandlerBox(Box):
+    _type = 'hdlr'
+
+
+class MediaInformationBox(ContainerBox):
+    _type = 'minf'
+
+
+class SoundMediaHeaderBox(Box):
+    _type = 'smhd'
+
+
+class DataInformationBox(Box):
+    _type = 'dinf'
+
+
+class SampleTableBox(ContainerBox):
+    _type = 'stbl'
+
+
+class SampleDescriptionBox(_ContainerMixin, FullBox):
+    _type = 'stsd'
+
+    def __init__(self, size, _type, data):
+        FullBox.__init__(self, size, _type, data)
+        (self.entry_count,) = unpack_from('>I', data, 4)
+        _ContainerMixin.__init__(self, data[8:])
+
+    def __repr__(self, prefix=''):
+        boxes = '\n'.join(c.__repr__(f'{prefix}  ') for c in self.boxes)
+        return f'''{super().__repr__(prefix)}
+{prefix} - entryCount: {self.entry_count}
+{boxes}'''
+
+
+class AudioSampleEntry(_ContainerMixin, Box):
+    _type = 'mp4a'
+
+    def __init__(self, size, _type, data):
+        Box.__init__(self, size, _type, data)
+        # 6 reserved, data_reference_index, 8 reserved
+        (
+            self.data_reference_index,
+            self.channel_count,
+            self.sample_size,
+            self.sample_rate,
+        ) = unpack_from('>6xH8xHH4xI', data)
+        self.sample_rate >>= 16
+        _ContainerMixin.__init__(self, data[28:])
+
+    def __repr__(self, prefix=''):
+        boxes = '\n'.join(c.__repr__(f'{prefix}  ') for c in self.boxes)
+        return f'''{super().__repr__(prefix)}
+{prefix} - channelCount: {self.channel_count}
+{prefix} - sampleSize: {self.sample_size}
+{prefix} - sampleRate: {self.sample_rate}
+{boxes}'''
+
+
+class BitRateBox(Box):
+    _type = 'btrt'
+
+
+def _descriptor(data, offset):
+    # MPEG-4 descriptor header, a tag and then a size made up of 7-bit chunks
+    # with the high bit set when more follow
+    tag = data[offset]
+    offset += 1
+    size = 0
+    for _ in range(4):
+        b = data[offset]
+        offset += 1
+        size = (size << 7) | (b & 0x7F)
+        if not b & 0x80:
+            break
+    return tag, size, offset
+
+
+class _BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n):
+        v = 0
+        for _ in range(n):
+            byte = self.data[self.pos >> 3]
+            v = (v << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return v
+
+
+class ElementaryStreamDescriptorBox(FullBox):
+    _type = 'esds'
+
+    ES_DESCRIPTOR = 0x03
+    DECODER_CONFIG_DESCRIPTOR = 0x04
+    DECODER_SPECIFIC_INFO = 0x05
+
+    SAMPLING_FREQUENCIES = (
+        96000,
+        88200,
+        64000,
+        48000,
+        44100,
+        32000,
+        24000,
+        22050,
+        16000,
+        12000,
+        11025,
+        8000,
+        7350,
+    )
+
+    def __init__(self, size, _type, data):
+        super().__init__(size, _type, data)
+        self.object_type_indication = None
+        self.audio_specific_config = None
+        self.audio_object_type = None
+        self.sampling_frequency_index = None
+        self.sampling_frequency = None
+        self.channel_configuration = None
+
+        offset = 4
+        end = len(data)
+        while offset < end:
+            tag, size, offset = _descriptor(data, offset)
+            if tag == self.ES_DESCRIPTOR:
+                # ES_ID, then flags that say what optional bits follow
+                flags = data[offset + 2]
+                offset += 3
+                if flags & 0x80:
+                    offset += 2
+                if flags & 0x40:
+                    offset += 1 + data[offset]
+                if flags & 0x20:
+                    offset += 2
+                # our children follow
+                continue
+            elif tag == self.DECODER_CONFIG_DESCRIPTOR:
+                self.object_type_indication = data[offset]
+                # stream type, buffer size, max and avg bitrate
+                offset += 13
+                # our children follow
+                continue
+            elif tag == self.DECODER_SPECIFIC_INFO:
+                self.audio_specific_config = bytes(data[offset : offset + size])
+                self._parse_audio_specific_config()
+            offset += size
+
+    def _parse_audio_specific_config(self):
+        reader = _BitReader(self.audio_specific_config)
+
+        def object_type():
+            aot = reader.read(5)
+            if aot == 31:
+                aot = 32 + reader.read(6)
+            return aot
+
+        def sampling_frequency():
+            index = reader.read(4)
+            if index == 0xF:
+                return index, reader.read(24)
+            try:
+                return index, self.SAMPLING_FREQUENCIES[index]
+            except IndexError:
+                return index, None
+
+        self.audio_object_type = object_type()
+        (
+            self.sampling_frequency_index,
+            self.sampling_frequency,
+        ) = sampling_frequency()
+        self.channel_configuration = reader.read(4)
+        if self.audio_object_type in (5, 29):
+            # HE-AAC (SBR/PS), what we were given is the core sample rate, skip
+            # the extension one and pick up the underlying object type
+            sampling_frequency()
+            self.audio_object_type = object_type()
+
+    def __repr__(self, prefix=''):
+        return f'''{super().__repr__(prefix)}
+{prefix} - objectTypeIndication: {self.object_type_indication}
+{prefix} - audioObjectType: {self.audio_object_type}
+{prefix} - samplingFrequency: {self.sampling_frequency}
+{prefix} - channelConfiguration: {self.channel_configuration}'''
+
+
+class SampleToChunkBox(Box):
+    _type = 'stsc'
+
+
+class TimeToSampleBox(Box):
+    _type = 'stts'
+
+
+class SampleSizeBox(Box):
+    _type = 'stsz'
+
+
+class ChunkOffsetBox(Box):
+    _type = 'stco'
+
+
 class Emsg(Box):
     _type = 'emsg'
 
@@ -143,9 +440,7 @@ class MovieFragmentHeaderBox(FullBox):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        # TODO: kind of annoying they'll all have to do this...
-        data = data[4:]
-        self.sequence_number = int.from_bytes(data[:4], 'big')
+        (self.sequence_number,) = unpack_from('>I', data, 4)
 
     def __repr__(self, prefix=''):
         return f'''{super().__repr__(prefix)}
@@ -161,38 +456,36 @@ class TrackFragmentHeaderBox(FullBox):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        # TODO: kind of annoying they'll all have to do this...
-        data = data[4:]
-        self.track_id = int.from_bytes(data[:4], 'big')
-        data = data[4:]
+        (self.track_id,) = unpack_from('>I', data, 4)
+        offset = 8
 
         if self.flags & 0x000001:
-            self.base_data_offset = int.from_bytes(data[:8], 'big')
-            data = data[8:]
+            (self.base_data_offset,) = unpack_from('>Q', data, offset)
+            offset += 8
         else:
             self.base_data_offset = None
 
         if self.flags & 0x000002:
-            self.sample_description_index = int.from_bytes(data[:4], 'big')
-            data = data[4:]
+            (self.sample_description_index,) = unpack_from('>I', data, offset)
+            offset += 4
         else:
             self.sample_description_index = None
 
         if self.flags & 0x000008:
-            self.default_sample_duration = int.from_bytes(data[:4], 'big')
-            data = data[4:]
+            (self.default_sample_duration,) = unpack_from('>I', data, offset)
+            offset += 4
         else:
             self.default_sample_duration = None
 
         if self.flags & 0x000010:
-            self.default_sample_size = int.from_bytes(data[:4], 'big')
-            data = data[4:]
+            (self.default_sample_size,) = unpack_from('>I', data, offset)
+            offset += 4
         else:
             self.default_sample_size = None
 
         if self.flags & 0x000020:
-            self.default_sample_flags = int.from_bytes(data[:4], 'big')
-            data = data[4:]
+            (self.default_sample_flags,) = unpack_from('>I', data, offset)
+            offset += 4
         else:
             self.default_sample_flags = None
 
@@ -234,9 +527,8 @@ class TrackFragmentBaseMediaDecodeTimeBox(FullBox):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        # TODO: kind of annoying they'll all have to do this...
-        data = data[4:]
-        self.base_media_decode_time = int.from_bytes(data[:8], 'big')
+        fmt = '>Q' if self.version == 1 else '>I'
+        (self.base_media_decode_time,) = unpack_from(fmt, data, 4)
 
     def __repr__(self, prefix=''):
         return f'''{super().__repr__(prefix)}
@@ -248,20 +540,18 @@ class TrackFragmentRunBox(FullBox):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
-        # TODO: kind of annoying they'll all have to do this...
-        data = data[4:]
-        self.sample_count = int.from_bytes(data[:4], 'big')
-        data = data[4:]
+        (self.sample_count,) = unpack_from('>I', data, 4)
+        offset = 8
 
         if self.flags & 0x000001:
-            self.data_offset = int.from_bytes(data[:4], 'big')
-            data = data[4:]
+            (self.data_offset,) = unpack_from('>i', data, offset)
+            offset += 4
         else:
             self.data_offset = None
 
         if self.flags & 0x000004:
-            self.first_sample_flags = int.from_bytes(data[:4], 'big')
-            data = data[4:]
+            (self.first_sample_flags,) = unpack_from('>I', data, offset)
+            offset += 4
         else:
             self.first_sample_flags = None
 
@@ -270,33 +560,51 @@ class TrackFragmentRunBox(FullBox):
         self.sample_flags_present = self.flags & 0x000400
         self.sample_composition_time_offset_present = self.flags & 0x000800
 
-        self.sample_durations = []
-        self.sample_sizes = []
-        self.sample_flags = []
-        self.sample_composition_time_offsets = []
-
-        while data:
-            if self.sample_duration_present:
-                self.sample_durations.append(int.from_bytes(data[:4], 'big'))
-                data = data[4:]
-            if self.sample_size_present:
-                self.sample_sizes.append(int.from_bytes(data[:4], 'big'))
-                data = data[4:]
-            if self.sample_flags_present:
-                self.sample_flags.append(int.from_bytes(data[:4], 'big'))
-                data = data[4:]
-            if self.sample_composition_time_offset_present:
-                self.sample_composition_time_offsets.append(
-                    int.from_bytes(data[:4], 'big')
-                )
-                data = data[4:]
+        present = (
+            self.sample_duration_present,
+            self.sample_size_present,
+            self.sample_flags_present,
+            self.sample_composition_time_offset_present,
+        )
+        width = sum(1 for p in present if p)
+
+        # decode the whole sample table in one go, it's a big-endian
+        # sample_count x width grid of 32-bit values, and then pull each
+        # present field's column out with a strided slice
+        table = array(_UINT32)
+        if width:
+            table.frombytes(
+                data[offset : offset + self.sample_count * width * 4]
+            )
+            if byteorder == 'little':
+                table.byteswap()
+
+        columns = []
+        column = 0
+        for p in present:
+            if p:
+                columns.append(table[column::width])
+                column += 1
+            else:
+                columns.append(array(_UINT32))
+        (
+            self.sample_durations,
+            self.sample_sizes,
+            self.sample_flags,
+            self.sample_composition_time_offsets,
+        ) = columns
+        if self.version == 1:
+            # composition offsets are signed in version 1
+            self.sample_composition_time_offsets = array(
+                _INT32, self.sample_composition_time_offsets.tobytes()
+            )
 
     def __repr__(self, prefix=''):
         # TODO: print if present
         return f'''{super().__repr__(prefix)}
 {prefix} - sampleCount: {self.sample_count}
 {prefix} - dataOffset: {self.data_offset}
-{prefix} - sampleSizes: {self.sample_sizes}'''
+{prefix} - sampleSizes: {self.sample_sizes.tolist()}'''
 
 
 class MediaDataBox(Box):
@@ -304,79 +612,414 @@ class MediaDataBox(Box):
 
     def __init__(self, size, _type, data):
         super().__init__(size, _type, data)
+        # a view into the segment, not a copy
         self.data = data
 
-    def frames(self, frame_sizes):
-        # walk trun's list of frame sizes, picking up where we left off each
-        # time
-        s = 0
-        for n in frame_sizes:
-            yield self.data[s : s + n]
-            s = s + n
-
 
-def box_up(data):
-    boxes = []
+# placeholder for a box that's been indexed but not built yet, Box.new gives
+# None for types we don't handle
+_UNBUILT = object()
+
+
+def box_index(data):
+    # walk a single memoryview by offset reading only the headers, returns
+    # the view and (type, size, offset, header size) for each box
+    data = memoryview(data)
+    end = len(data)
+    entries = []
+
+    offset = 0
+    while offset + 8 <= end:
+        box_size, box_type = unpack_from('>I4s', data, offset)
+        box_type = box_type.decode()
+        header = 8
+        if box_size == 1:
+            # 64-bit largesize follows the type
+            if offset + 16 > end:
+                break
+            (box_size,) = unpack_from('>Q', data, offset + 8)
+            header = 16
+        elif box_size == 0:
+            # box extends to the end of the data
+            box_size = end - offset
+        if box_size < header:
+            Box.log.warning('box_index: invalid box_size=%d', box_size)
+            break
+
+        entries.append((box_type, box_size, offset, header))
+        offset += box_size
+
+    return data, entries
+
+
+def _default(name, tfhd, trex):
+    # tfhd's default for a field, falling back to trex's
+    value = tfhd and getattr(tfhd, name)
+    if not value and trex is not None:
+        value = getattr(trex, name)
+    return value
+
+
+def _runs(moof, moof_offset, trex):
+    # where each of a moof's truns' samples are, (traf, trun, sizes, start)
+    # with start (offset, in_mdat). offset is absolute, or when in_mdat is
+    # set relative to the payload of the mdat that follows the moof, that's
+    # where samples go when nothing says otherwise. start is None when it
+    # can't be worked out, e.g. moof_offset is unknown. truns without sample
+    # sizes are skipped
+    log = getLogger('Mp4')
+    # where the previous trun's samples finished
+    data_end = None
+    for t, traf in enumerate(moof.get('traf')):
+        tfhd = next(traf.get('tfhd'), None)
+        default_size = _default('default_sample_size', tfhd, trex)
+
+        explicit = tfhd is not None and tfhd.base_data_offset is not None
+        if explicit:
+            base = (tfhd.base_data_offset, False)
+        elif t == 0 or (tfhd is not None and tfhd.flags & 0x020000):
+            # default-base-is-moof, or the first traf
+            base = None if moof_offset is None else (moof_offset, False)
+        else:
+            base = data_end
+
+        for r, trun in enumerate(traf.get('trun')):
+            n = trun.sample_count
+            if trun.sample_size_present:
+                sizes = trun.sample_sizes
+            elif default_size:
+                sizes = array(_UINT32, repeat(default_size, n))
+            else:
+                log.warning('_runs: no sample sizes, skipping trun')
+                continue
+
+            if trun.data_offset is not None:
+                start = (
+                    None
+                    if base is None
+                    else (base[0] + trun.data_offset, base[1])
+                )
+            elif r == 0 and explicit:
+                start = base
+            elif data_end is not None:
+                start = data_end
+            else:
+                start = (0, True)
+            yield traf, trun, sizes, start
+            data_end = (
+                None if start is None else (start[0] + sum(sizes), start[1])
+            )
 
-    while data:
-        box_size = int.from_bytes(data[0:4], 'big')
-        box_type = data[4:8].decode()
 
-        box = Box.new(box_size, box_type, data[8:box_size])
-        if box:
-            boxes.append(box)
+# Every sample in a segment, across all of its moofs, trafs and truns, as
+# parallel arrays of absolute offset into the segment, size, duration and
+# decode time, the latter two in timescale units. Built once per segment so
+# framing, durations, and seeking are lookups and slices rather than walks of
+# the boxes. offsets is empty when the segment's layout isn't known, e.g. for
+# Mp4Parser's boxes, and durations and decode_times are None when the segment
+# doesn't say how long its samples are.
+class SampleIndex:
+    log = getLogger('SampleIndex')
+
+    def __init__(self, offsets, sizes, durations, decode_times):
+        self.offsets = offsets
+        self.sizes = sizes
+        self.durations = durations
+        self.decode_times = decode_times
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def at(self, decode_time):
+        # the sample playing at decode_time, clamped to the segment
+        if not self.decode_times:
+            return None
+        return max(bisect_right(self.decode_times, decode_time) - 1, 0)
 
-        data = data[box_size:]
+    @classmethod
+    def build(cls, mp4):
+        trex = mp4.find('moov', 'mvex', 'trex')
+        entries = mp4._entries
+        offsets = array('q')
+        sizes = array(_UINT32)
+        durations = array(_UINT32)
+        decode_times = array('Q')
+        timed = placed = True
+        decode_time = 0
+
+        for i in mp4._types.get('moof', ()):
+            moof = mp4._box(i)
+            # the payload of the mdat following the moof
+            mdat_offset = next(
+                (
+                    offset + header
+                    for _type, _, offset, header in entries[i + 1 :]
+                    if _type == 'mdat' and offset is not None
+                ),
+                None,
+            )
+            current = None
+            for traf, trun, run_sizes, start in _runs(
+                moof, entries[i][2], trex
+            ):
+                if traf is not current:
+                    current = traf
+                    tfhd = next(traf.get('tfhd'), None)
+                    tfdt = next(traf.get('tfdt'), None)
+                    if tfdt is not None:
+                        decode_time = tfdt.base_media_decode_time
+                    default_duration = _default(
+                        'default_sample_duration', tfhd, trex
+                    )
+
+                if start is None or (start[1] and mdat_offset is None):
+                    placed = False
+                    offset = 0
+                else:
+                    offset = start[0] + (mdat_offset if start[1] else 0)
+                offsets.extend(accumulate(run_sizes, initial=offset))
+                offsets.pop()
+                sizes.extend(run_sizes)
+
+                n = trun.sample_count
+                if trun.sample_duration_present:
+                    run_durations = trun.sample_durations
+                elif default_duration:
+                    run_durations = array(_UINT32, repeat(default_duration, n))
+                else:
+                    timed = False
+                    continue
+                durations.extend(run_durations)
+                decode_times.extend(
+                    accumulate(run_durations, initial=decode_time)
+                )
+                decode_time = decode_times.pop()
 
-    return boxes
+        if not placed:
+            offsets = array('q')
+        if not timed:
+            durations = decode_times = None
+        return cls(offsets, sizes, durations, decode_times)
 
 
 class Mp4(_ContainerMixin):
     log = getLogger('Mp4')
 
-    def __init__(self, data):
-        _ContainerMixin.__init__(self, data)
+    def __init__(self, data, boxes=None):
+        if boxes is None:
+            _ContainerMixin.__init__(self, data)
+        else:
+            # already parsed, e.g. by Mp4Parser
+            self._data = None
+            self._index(
+                [(b._type, b.size, None, 8) for b in boxes], list(boxes)
+            )
         self._time = None
         self._duration = None
+        self._samples = None
+
+    @property
+    def timescale(self):
+        # the track's, which is what tfdt and trun are in, falling back to the
+        # movie's
+        mdhd = self.find('moov', 'trak', 'mdia', 'mdhd')
+        if mdhd is not None:
+            return mdhd.timescale
+        return next(next(self.get('moov')).get('mvhd')).timescale
+
+    @property
+    def base_media_decode_time(self):
+        # in timescale units, None when there's no tfdt
+        tfdt = self.find('moof', 'traf', 'tfdt')
+        return None if tfdt is None else tfdt.base_media_decode_time
+
+    @property
+    def samples(self):
+        if self._samples is None:
+            self._samples = SampleIndex.build(self)
+        return self._samples
+
+    @property
+    def sample_durations(self):
+        # every sample's duration in timescale units, in order across all of
+        # the truns, or None if the segment doesn't say
+        return self.samples.durations
 
     @property
     def time(self):
         if self._time is None:
-            # TODO: multiple support?
-            timescale = next(next(self.get('moov')).get('mvhd')).timescale
-            moof = next(self.get('moof'))
-            traf = next(moof.get('traf'))
-            tfdt = next(traf.get('tfdt'))
-            self._time = tfdt.base_media_decode_time / float(timescale)
+            samples = self.samples
+            if samples.decode_times:
+                decode_time = samples.decode_times[0]
+            else:
+                moof = next(self.get('moof'))
+                traf = next(moof.get('traf'))
+                decode_time = next(traf.get('tfdt')).base_media_decode_time
+            self._time = decode_time / float(self.timescale)
         return self._time
 
+    @property
+    def esds(self):
+        # the track's codec config, only there when the segment carries moov
+        return self.find(
+            'moov', 'trak', 'mdia', 'minf', 'stbl', 'stsd', 'mp4a', 'esds'
+        )
+
     @property
     def frames(self):
-        truns = []
-        for moof in self.get('moof'):
-            for traf in moof.get('traf'):
-                truns.extend(traf.get('trun'))
-
-        # TODO: what does multiple truns/mdats look like
-        trun = truns[0]
-        mdat = next(self.get('mdat'))
-        s = 0
-        for n in trun.sample_sizes:
-            yield mdat.data[s : s + n]
-            s += n
+        samples = self.samples
+        data = self._data
+        for offset, size in zip(samples.offsets, samples.sizes):
+            yield data[offset : offset + size]
 
     @property
     def duration(self):
         if self._duration is None:
-            # TODO: what about multiples
-            timescale = next(next(self.get('moov')).get('mvhd')).timescale
-            traf = next(next(self.get('moof')).get('traf'))
-            sample_duration = next(traf.get('tfhd')).default_sample_duration
-            sample_count = next(traf.get('trun')).sample_count
-            self._duration = float(sample_count * sample_duration) / float(
-                timescale
-            )
+            # without a moof there's nothing to go on, callers expect
+            # StopIteration for that
+            next(self.get('moof'))
+            durations = self.samples.durations
+            if durations is None:
+                return None
+            self._duration = sum(durations) / float(self.timescale)
         return self._duration
 
     def __repr__(self):
         return '\n'.join(str(b) for b in self.boxes)
+
+
+# Push parser for a segment that's still downloading. feed it data as it
+# arrives and it returns any AAC samples that have fully landed so far, in
+# trun order. Everything other than mdat is parsed once its box is complete,
+# so moov and moof are available by the time samples start coming out. Where
+# each moof's samples are is worked out the same way SampleIndex does, from
+# tfhd and trun's offsets, so positions are tracked from the start of the body.
+class Mp4Parser:
+
+    log = getLogger('Mp4Parser')
+
+    def __init__(self):
+        self.boxes = []
+        self._buf = bytearray()
+        # where in the body _buf starts
+        self._start = 0
+        # where the next box starts, None once there's nothing more to parse,
+        # e.g. after an mdat that runs to the end
+        self._next_box = 0
+        # (offset, size) of samples yet to be handed out, in order
+        self._samples = deque()
+        # samples positioned relative to the next mdat, waiting on it
+        self._unplaced = None
+        self._trex = None
+        self.size = 0
+
+    @property
+    def mp4(self):
+        # everything but the mdat, enough for time, duration, and esds
+        return Mp4(None, boxes=self.boxes)
+
+    def _moof(self, moof, moof_offset):
+        samples = []
+        relative = False
+        for _, _, sizes, start in _runs(moof, moof_offset, self._trex):
+            if start is None:
+                self.log.warning('_moof: unknown data offset, skipping trun')
+                continue
+            offset, in_mdat = start
+            relative = relative or in_mdat
+            for size in sizes:
+                samples.append((offset, size, in_mdat))
+                offset += size
+        if relative:
+            self._unplaced = samples
+        else:
+            self._samples.extend((o, n) for o, n, _ in samples)
+
+    def _mdat(self, payload):
+        if self._unplaced is not None:
+            self._samples.extend(
+                (o + payload if in_mdat else o, n)
+                for o, n, in_mdat in self._unplaced
+            )
+            self._unplaced = None
+
+    def _box(self):
+        # parse the next box if it's all here, returns whether we got anywhere
+        pos = self._next_box
+        if pos is None or pos + 8 > self.size:
+            return False
+        buf = self._buf
+        i = pos - self._start
+        box_size, box_type = unpack_from('>I4s', buf, i)
+        box_type = box_type.decode()
+        header_size = 8
+        if box_size == 1:
+            # 64-bit largesize follows the type
+            if pos + 16 > self.size:
+                return False
+            (box_size,) = unpack_from('>Q', buf, i + 8)
+            header_size = 16
+        elif box_size == 0 and box_type == 'mdat':
+            # runs to the end of the body
+            self._mdat(pos + header_size)
+            self._next_box = None
+            return True
+        if box_size < header_size:
+            self.log.warning('_box: invalid box_size=%d', box_size)
+            self._next_box = None
+            return False
+        if box_type == 'mdat':
+            # its samples are picked out as they land
+            self._mdat(pos + header_size)
+            self._next_box = pos + box_size
+            return True
+        if pos + box_size > self.size:
+            # wait for the rest of it
+            return False
+
+        box = Box.new(
+            box_size, box_type, memoryview(buf[i + header_size : i + box_size])
+        )
+        if box:
+            self.boxes.append(box)
+            if box_type == 'moov':
+                self._trex = box.find('mvex', 'trex')
+            elif box_type == 'moof':
+                self._moof(box, pos)
+        self._next_box = pos + box_size
+        return True
+
+    def feed(self, data):
+        self.size += len(data)
+        buf = self._buf
+        buf += data
+        frames = []
+
+        while self._box():
+            pass
+
+        samples = self._samples
+        while samples:
+            offset, size = samples[0]
+            if offset < self._start:
+                self.log.warning('feed: sample at offset=%d is gone', offset)
+                samples.popleft()
+                continue
+            if offset + size > self.size:
+                # waiting on the rest of it
+                break
+            samples.popleft()
+            i = offset - self._start
+            frames.append(bytes(buf[i : i + size]))
+
+        # hang on to what's still needed, the pending samples, which needn't
+        # be in order in the mdat, and the next box
+        keep = self.size
+        if samples:
+            keep = min(keep, min(offset for offset, _ in samples))
+        if self._next_box is not None:
+            keep = min(keep, self._next_box)
+        if keep > self._start:
+            del buf[: keep - self._start]
+            self._start = keep
+        return frames
@@ -0,0 +1,129 @@
+#
+#
+#
+
+from asyncio import sleep as async_sleep
+from logging import getLogger
+from time import monotonic, sleep
+
+from .metrics import PACING
+
+
+# Releases frames at real-time rate according to their media timestamps, the
+# segment's tfdt plus trun's sample durations. Each frame is scheduled to play
+# delay seconds after the first one arrived, plus its media time since, so
+# playout runs that far behind arrival and late segments are soaked up rather
+# than heard. Frames go out no more than ahead seconds in front of their
+# scheduled time, so that's the most a client ever has buffered, and new
+# listeners get ahead - delay of it straight away to get going.
+# Discontinuities, or a frame that arrives after it was scheduled to play,
+# e.g. when upstream stalls, re-anchor the clock rather than bursting to catch
+# up.
+class Pacer:
+    log = getLogger('Pacer')
+
+    # used when there's nothing to go on, AAC frames are 1024 samples
+    SAMPLES_PER_FRAME = 1024
+
+    def __init__(
+        self, ahead=2.0, delay=1.0, max_gap=1.0, clock=monotonic, sleep=sleep
+    ):
+        self.ahead = ahead
+        # jitter buffer, how far playout runs behind arrival
+        self.delay = delay
+        self.max_gap = max_gap
+        self.clock = clock
+        self.sleep = sleep
+
+        # clock time that media time _origin is scheduled to play
+        self._anchor = None
+        self._origin = None
+        # media time we expect the next frame to start at
+        self._next = None
+
+    def _reanchor(self, media_time, reason):
+        if self._anchor is not None:
+            self.log.info(
+                '_reanchor: reason=%s, media_time=%f', reason, media_time
+            )
+            PACING.inc(action=reason)
+        self._anchor = self.clock() + self.delay
+        self._origin = media_time
+
+    def _scheduled(self, media_time):
+        # when media_time should be playing
+        return self._anchor + (media_time - self._origin)
+
+    def _due(self, media_time):
+        # when it should go out
+        return self._scheduled(media_time) - self.ahead
+
+    def timeline(self, mp4, sample_rate=None):
+        # (start, duration) in seconds for each of a segment's frames, mp4 only
+        # needs its moov and moof, so a still downloading one's fine
+        try:
+            timescale = mp4.timescale
+            start = mp4.base_media_decode_time
+            durations = mp4.sample_durations
+        except (StopIteration, AttributeError):
+            timescale = start = durations = None
+
+        # assuming standard frames when there's nothing better to go on
+        duration = self.SAMPLES_PER_FRAME / float(sample_rate or 44100)
+        if not timescale or start is None or not durations:
+            # pick up where the last one left off
+            t = self._next or 0.0
+        else:
+            t = start / float(timescale)
+            for d in durations:
+                duration = d / float(timescale)
+                yield t, duration
+                t += duration
+
+        # more frames than mp4 knows about, e.g. a still downloading segment
+        # with more than one moof, carry on at the last frame's rate
+        while True:
+            yield t, duration
+            t += duration
+
+    def _step(self, frames, times, i):
+        # how far into frames is due now, or if nothing is, how long until
+        # frame i will be
+        start, duration = times[i]
+        if self._anchor is None:
+            self._reanchor(start, 'start')
+        elif abs(start - self._next) > self.max_gap:
+            self._reanchor(start, 'discontinuity')
+        elif self._scheduled(start) < self.clock():
+            # it's turned up after it should've started playing
+            self._reanchor(start, 'behind')
+
+        now = self.clock()
+        j = i
+        n = len(frames)
+        while j < n and self._due(times[j][0]) <= now:
+            self._next = times[j][0] + times[j][1]
+            j += 1
+        return j, self._due(start) - now
+
+    def pace(self, frames, times):
+        # yields runs of frames as they come due, times are (start, duration)
+        # for each of them
+        i = 0
+        while i < len(frames):
+            j, wait = self._step(frames, times, i)
+            if j > i:
+                yield frames[i:j]
+                i = j
+            else:
+                self.sleep(wait)
+
+    async def apace(self, frames, times):
+        i = 0
+        while i < len(frames):
+            j, wait = self._step(frames, times, i)
+            if j > i:
+                yield frames[i:j]
+                i = j
+            else:
+                await async_sleep(wait)
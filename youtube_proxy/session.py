@@ -0,0 +1,126 @@
+#
+#
+#
+
+from json import dumps
+from logging import getLogger
+from socket import IPPROTO_TCP, SO_KEEPALIVE, SOL_SOCKET
+from threading import Lock
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+log = getLogger('session')
+
+HEADERS = {
+    'accept-language': 'en-US,en',
+    'content-type': 'application/json',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.87 Safari/537.36',
+}
+
+_config = {'pool_hosts': 10, 'pool_size': 32, 'keep_alive': 60}
+_lock = Lock()
+_session = None
+
+
+def configure(pool_hosts=None, pool_size=None, keep_alive=None):
+    # must be called before the first get_session to have any effect
+    global _session
+    with _lock:
+        if pool_hosts is not None:
+            _config['pool_hosts'] = pool_hosts
+        if pool_size is not None:
+            _config['pool_size'] = pool_size
+        if keep_alive is not None:
+            _config['keep_alive'] = keep_alive
+        if _session is not None:
+            log.warning('configure: session already created, ignoring')
+
+
+def _socket_options(keep_alive):
+    options = list(HTTPConnection.default_socket_options)
+    if keep_alive:
+        # have the kernel probe idle pooled connections so that dead ones are
+        # noticed rather than handed out
+        options.append((SOL_SOCKET, SO_KEEPALIVE, 1))
+        try:
+            from socket import TCP_KEEPIDLE, TCP_KEEPINTVL
+
+            options.append((IPPROTO_TCP, TCP_KEEPIDLE, keep_alive))
+            options.append(
+                (IPPROTO_TCP, TCP_KEEPINTVL, max(keep_alive // 4, 1))
+            )
+        except ImportError:
+            # not available on this platform
+            pass
+    return options
+
+
+class _PoolAdapter(HTTPAdapter):
+    def __init__(self, socket_options, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_session():
+    # a single process-wide session whose connection pools are shared by
+    # everything talking to youtube/googlevideo, requests' Session is fine to
+    # share between threads for what we do with it
+    global _session
+    with _lock:
+        if _session is None:
+            log.info('get_session: creating, config=%s', _config)
+            adapter = _PoolAdapter(
+                _socket_options(_config['keep_alive']),
+                pool_connections=_config['pool_hosts'],
+                pool_maxsize=_config['pool_size'],
+            )
+            sess = Session()
+            sess.headers = dict(HEADERS)
+            sess.mount('https://', adapter)
+            sess.mount('http://', adapter)
+            _session = sess
+        return _session
+
+
+class _PytubeResponse:
+    # just enough of urlopen's response for pytube
+    def __init__(self, resp):
+        self._resp = resp
+
+    def read(self, amt=None):
+        return self._resp.raw.read(amt, decode_content=True)
+
+    def info(self):
+        return self._resp.headers
+
+
+def _execute_request(url, method=None, headers=None, data=None, timeout=None):
+    if data and not isinstance(data, bytes):
+        data = dumps(data).encode('utf-8')
+    if not isinstance(timeout, (int, float)):
+        # pytube defaults to socket's sentinel, i.e. none
+        timeout = None
+    resp = get_session().request(
+        method or ('POST' if data else 'GET'),
+        url,
+        headers=headers,
+        data=data,
+        timeout=timeout,
+        stream=True,
+    )
+    resp.raise_for_status()
+    return _PytubeResponse(resp)
+
+
+def install_pytube():
+    # route pytube's watch page, player js, and innertube requests through our
+    # pool rather than a fresh urlopen connection each time
+    from pytube import request
+
+    request._execute_request = _execute_request
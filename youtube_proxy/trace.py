@@ -0,0 +1,177 @@
+#
+#
+#
+
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from cProfile import Profile
+from io import StringIO
+from pstats import Stats
+from threading import Lock, current_thread
+from time import monotonic
+
+# the stages a chunk goes through, in order
+WAIT = 'wait'
+FETCH = 'fetch'
+PARSE = 'parse'
+DOWNLOAD = 'download'
+FRAME = 'frame'
+
+_NOTHING = nullcontext()
+
+
+class _Profiled:
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.profile = Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        self.tracer._merge(self.profile)
+
+
+# Opt-in timeline of where each chunk's time goes, waiting on upstream to
+# publish it, fetching, parsing, downloading, and framing & yielding it to
+# each listener. Spans are kept per stream in a bounded ring, newest last,
+# with their seq_num and upstream wall time so gaps a listener hears can be
+# lined up with what happened upstream. Off, size=0, recording costs a check.
+# Optionally the same stages are run under cProfile as well.
+class Tracer:
+    def __init__(self, size=0, streams=64, profiling=False):
+        # spans kept per stream, 0 to turn tracing off
+        self.size = size
+        # rings kept, the least recently traced stream's goes first
+        self.streams = streams
+        self._lock = Lock()
+        self._rings = OrderedDict()
+        self.profiling = profiling
+        self._stats = None
+
+    def configure(self, size=None, streams=None, profiling=None):
+        with self._lock:
+            if size is not None:
+                self.size = size
+                self._rings.clear()
+            if streams is not None:
+                self.streams = streams
+        if profiling is not None:
+            self.profile(profiling)
+
+    def record(self, vid, stage, start, seq_num=None, walltime=None, end=None):
+        # start and end are monotonic(), end defaults to now
+        if not self.size:
+            return
+        end = monotonic() if end is None else end
+        thread = current_thread()
+        span = (stage, start, end, seq_num, walltime, thread.ident, thread.name)
+        with self._lock:
+            ring = self._rings.get(vid)
+            if ring is None:
+                ring = self._rings[vid] = deque(maxlen=self.size)
+                while len(self._rings) > self.streams:
+                    self._rings.popitem(last=False)
+            else:
+                self._rings.move_to_end(vid)
+            ring.append(span)
+
+    def spans(self, vid=None):
+        with self._lock:
+            if vid is not None:
+                return {vid: list(self._rings.get(vid, ()))}
+            return {v: list(ring) for v, ring in self._rings.items()}
+
+    def json(self, vid=None):
+        return {
+            v: [
+                {
+                    'stage': stage,
+                    'start': start,
+                    'end': end,
+                    'duration': end - start,
+                    'seq_num': seq_num,
+                    'walltime': walltime,
+                    'thread': name,
+                }
+                for stage, start, end, seq_num, walltime, _, name in spans
+            ]
+            for v, spans in self.spans(vid).items()
+        }
+
+    def chrome(self, vid=None):
+        # Chrome's trace event format, chrome://tracing or ui.perfetto.dev,
+        # each stream is a process and each thread that touched it a row
+        events = []
+        for pid, (v, spans) in enumerate(self.spans(vid).items(), 1):
+            events.append(
+                {
+                    'name': 'process_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'args': {'name': v},
+                }
+            )
+            threads = {}
+            for stage, start, end, seq_num, walltime, tid, name in spans:
+                threads[tid] = name
+                events.append(
+                    {
+                        'name': stage,
+                        'cat': 'chunk',
+                        'ph': 'X',
+                        'ts': start * 1e6,
+                        'dur': (end - start) * 1e6,
+                        'pid': pid,
+                        'tid': tid,
+                        'args': {'seq_num': seq_num, 'walltime': walltime},
+                    }
+                )
+            for tid, name in threads.items():
+                events.append(
+                    {
+                        'name': 'thread_name',
+                        'ph': 'M',
+                        'pid': pid,
+                        'tid': tid,
+                        'args': {'name': name},
+                    }
+                )
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def profile(self, enabled):
+        # turning it on starts over
+        with self._lock:
+            if enabled and not self.profiling:
+                self._stats = None
+            self.profiling = enabled
+
+    def profiled(self):
+        # a context that runs its block under cProfile when profiling is on.
+        # cProfile only sees the thread that enables it so every traced stage
+        # gets its own, merged in as they finish. don't hold one across a
+        # yield or await
+        if not self.profiling:
+            return _NOTHING
+        return _Profiled(self)
+
+    def _merge(self, profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def report(self, sort='cumulative', limit=50):
+        buf = StringIO()
+        with self._lock:
+            stats = self._stats
+            if stats is None:
+                return 'no profile data\n'
+            stats.stream = buf
+            stats.sort_stats(sort).print_stats(limit)
+        return buf.getvalue()
+
+
+tracer = Tracer()
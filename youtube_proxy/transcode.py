@@ -2,34 +2,123 @@
 #
 #
 
+from asyncio import get_running_loop
 from logging import getLogger
-from time import sleep
+from time import monotonic
+
+from .metrics import EMITTED_BYTES, EMITTED_FRAMES
+from .trace import FRAME, tracer
 
 
 class Transcoder:
     log = getLogger('Transcoder')
 
-    def __init__(self, youtube_streamer, startup_delay=5.0):
+    def __init__(self, subscription, pacer=None):
         self.log.info(
-            '__init__: youtube_streamer=%s, startup_delay=%f',
-            youtube_streamer,
-            startup_delay,
+            '__init__: subscription=%s, pacer=%s', subscription, pacer
         )
-        self.youtube_streamer = youtube_streamer
-        self.startup_delay = startup_delay
+        self.subscription = subscription
+        # releases frames at real-time rate, or None to send them as fast as
+        # they come
+        self.pacer = pacer
 
     def acc_audio(self):
         self.log.info('acc_audio: ')
-        yts = self.youtube_streamer
-
-        yts.start()
-        sleep(self.startup_delay)
-
-        # TODO: figure out how to stuff title, author, image url etc in here if
-        # possible
-        while chunk := yts.queue.get(timeout=30):
-            for frame in chunk.mp4.frames:
-                n = len(frame) + 7
-                header = f'111111111111000101010000100000{n:013b}1111111111100'
-                header = int(header, 2).to_bytes(7, byteorder='big')
-                yield header + frame
+        subscription = self.subscription
+        pacer = self.pacer
+
+        try:
+            # no startup delay, we block on the first chunk and start yielding
+            # the moment it's there. any pre-roll comes from the subscription
+            # TODO: figure out how to stuff title, author, image url etc in
+            # here if possible
+            while chunk := subscription.get(timeout=30):
+                start = monotonic()
+                # a whole chunk at a time, or as frames arrive when the chunk
+                # is still downloading. they're framed once by the chunk, all
+                # that's left is picking out runs of them
+                timeline = None
+                for audio, offsets in chunk.adts():
+                    frames = range(len(offsets) - 1)
+                    if pacer is None:
+                        runs = (frames,)
+                    else:
+                        timeline = timeline or self._timeline(chunk)
+                        times = [next(timeline) for _ in frames]
+                        runs = pacer.pace(frames, times)
+                    for run in runs:
+                        # WSGI wants bytes, it's a copy out of the chunk's
+                        # buffer but there's no framing to be done
+                        data = bytes(
+                            audio[offsets[run.start] : offsets[run.stop]]
+                        )
+                        EMITTED_FRAMES.inc(len(run))
+                        EMITTED_BYTES.inc(len(data))
+                        yield data
+                # framing, pacing, and getting it out to the listener
+                tracer.record(
+                    subscription.vid, FRAME, start, chunk.seq_num, chunk.seen_at
+                )
+        finally:
+            self.log.info('acc_audio: done')
+            subscription.close()
+
+    def _timeline(self, chunk):
+        # moof's there by the time frames are
+        return self.pacer.timeline(
+            chunk.mp4, getattr(chunk.esds, 'sampling_frequency', None)
+        )
+
+    async def acc_audio_async(self):
+        # acc_audio for asyncio, a listener is a coroutine rather than a thread
+        self.log.info('acc_audio_async: ')
+        subscription = self.subscription
+        pacer = self.pacer
+
+        try:
+            while chunk := await subscription.aget(timeout=30):
+                start = monotonic()
+                timeline = None
+                async for audio, offsets in chunk.aadts():
+                    frames = range(len(offsets) - 1)
+                    if pacer is None:
+                        EMITTED_FRAMES.inc(len(frames))
+                        EMITTED_BYTES.inc(len(audio))
+                        yield audio
+                        continue
+                    timeline = timeline or self._timeline(chunk)
+                    times = [next(timeline) for _ in frames]
+                    async for run in pacer.apace(frames, times):
+                        # views over the chunk's buffer go out as is
+                        data = audio[offsets[run.start] : offsets[run.stop]]
+                        EMITTED_FRAMES.inc(len(run))
+                        EMITTED_BYTES.inc(len(data))
+                        yield data
+                tracer.record(
+                    subscription.vid, FRAME, start, chunk.seq_num, chunk.seen_at
+                )
+        finally:
+            self.log.info('acc_audio_async: done')
+            # unsubscribing can stop & join the streamer, keep that off of
+            # the loop
+            await get_running_loop().run_in_executor(None, subscription.close)
+
+    def encoded(self):
+        # already encoded elsewhere, e.g. by an EncoderPool, just pass it on
+        self.log.info('encoded: ')
+        subscription = self.subscription
+
+        try:
+            header = True
+            while chunk := subscription.get(timeout=30):
+                if header and chunk.header:
+                    # we're most likely joining part way through, whatever
+                    # the container starts with comes first
+                    EMITTED_BYTES.inc(len(chunk.header))
+                    yield chunk.header
+                header = False
+                EMITTED_BYTES.inc(chunk.size)
+                yield chunk.content
+        finally:
+            self.log.info('encoded: done')
+            subscription.close()
@@ -0,0 +1,84 @@
+#
+#
+#
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from .fetch import HedgedFetcher
+from .metrics import EMITTED_BYTES, VOD_PIECES
+
+# pieces are fetched on their own pool, and only on it. they're big and slow
+# by design, hedging them would double the transfer and tie up the pool
+# every live streamer's segment fetches go through
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='Vod')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+# Downloads a regular, non-live, video's audio in byte range pieces, several
+# at a time, since googlevideo throttles each connection well below what a
+# handful of them get together. Pieces are handed out in order as they land.
+class VodDownloader:
+    def __init__(
+        self, vid, url, size, piece_size=1024 * 1024, parallelism=4, timeout=10
+    ):
+        self.log = getLogger(f'VodDownloader[{vid}]')
+        self.vid = vid
+        self.url = url
+        self.size = size
+        self.piece_size = piece_size
+        self.parallelism = parallelism
+        self._fetcher = HedgedFetcher(vid, timeout=timeout, hedge=False)
+
+    def span(self, _range):
+        # werkzeug Range -> (start, end) inclusive, or the whole thing for no
+        # range. multiple ranges aren't worth the trouble, we ignore them and
+        # send it all, which is allowed
+        if _range is None or len(_range.ranges) != 1:
+            return None
+        span = _range.range_for_length(self.size)
+        if span is None:
+            raise RangeNotSatisfiable()
+        start, stop = span
+        return start, stop - 1
+
+    def _piece(self, start, end):
+        resp = self._fetcher.get(
+            self.url, headers={'range': f'bytes={start}-{end}'}
+        )
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise ValueError(f'range ignored, status={resp.status_code}')
+        VOD_PIECES.inc()
+        return resp.content
+
+    def iter_range(self, start=0, end=None):
+        end = self.size - 1 if end is None else end
+        self.log.info('iter_range: start=%d, end=%d', start, end)
+        offsets = iter(range(start, end + 1, self.piece_size))
+        pending = deque()
+
+        def submit():
+            for offset in offsets:
+                last = min(offset + self.piece_size - 1, end)
+                pending.append(_executor.submit(self._piece, offset, last))
+                return
+
+        try:
+            for _ in range(self.parallelism):
+                submit()
+            while pending:
+                data = pending.popleft().result()
+                # keep parallelism pieces in flight
+                submit()
+                EMITTED_BYTES.inc(len(data))
+                yield data
+        finally:
+            # the listener's gone, or we failed, don't bother with the rest
+            for future in pending:
+                future.cancel()
+            self.log.info('iter_range: done')
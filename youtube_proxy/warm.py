@@ -0,0 +1,67 @@
+#
+#
+#
+
+from logging import getLogger
+from threading import Event, Thread
+
+
+def load_favourites(videos=None, path=None):
+    # comma and/or whitespace separated ids, plus a file of them, one or more
+    # per line with # comments
+    vids = []
+    if videos:
+        vids.extend(videos.replace(',', ' ').split())
+    if path:
+        try:
+            with open(path) as fh:
+                for line in fh:
+                    vids.extend(line.split('#', 1)[0].replace(',', ' ').split())
+        except OSError as e:
+            getLogger('Warmer').warning(
+                'load_favourites: path=%s, e=%s', path, e
+            )
+    # keep order, drop dupes
+    return list(dict.fromkeys(vids))
+
+
+# Keeps a configured list of videos pinned in Broadcasters so that their url
+# is resolved, their connection open, and their latest segments buffered
+# before anyone asks for them. Every interval it re-reads the list and
+# restarts any that have stopped.
+class Warmer(Thread):
+    log = getLogger('Warmer')
+
+    def __init__(self, broadcasters, videos=None, path=None, interval=300.0):
+        super().__init__(name='Warmer', daemon=True)
+        self.broadcasters = broadcasters
+        self.videos = videos
+        self.path = path
+        self.interval = interval
+        self._stopped = Event()
+
+    def warm(self):
+        vids = load_favourites(self.videos, self.path)
+        for vid in self.broadcasters.pinned - set(vids):
+            self.log.info('warm: unpinning vid=%s', vid)
+            self.broadcasters.unpin(vid)
+        for vid in vids:
+            try:
+                self.broadcasters.pin(vid)
+            except Exception:
+                self.log.exception('warm: vid=%s failed', vid)
+        return vids
+
+    def run(self):
+        self.log.info('run: interval=%f', self.interval)
+        while True:
+            try:
+                vids = self.warm()
+                self.log.debug('run: warm vids=%s', vids)
+            except Exception:
+                self.log.exception('run: failed')
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
@@ -2,37 +2,499 @@
 #
 #
 
+from array import array
 from dataclasses import dataclass, field
+from itertools import accumulate
 from logging import getLogger
 from queue import Queue
-from threading import Thread
-from time import sleep, time
-
-from requests import Session
-from pytube import YouTube as _YouTube
-
-from .mp4 import Mp4
-
-
-@dataclass(order=True)
+from threading import Condition, Event, Lock, Thread, current_thread
+from time import monotonic, perf_counter, sleep, time
+from urllib.parse import parse_qs, urlparse
+
+from requests import RequestException
+
+from .adts import AdtsWriter
+from .aio import AsyncWaiters
+from .fetch import HedgedFetcher
+from .metrics import (
+    ACTIVE_STREAMERS,
+    FETCH_LATENCY,
+    FETCHES,
+    MP4_PARSE,
+    QUEUE_DEPTH,
+)
+from .mp4 import _UINT32, Mp4, Mp4Parser
+from .session import get_session, install_pytube
+from .trace import DOWNLOAD, FETCH, PARSE, WAIT, tracer
+
+
+def _tail(pieces, sent):
+    # what's left of pieces once the first sent bytes of them are skipped
+    tail = []
+    for piece in pieces:
+        if sent >= len(piece):
+            sent -= len(piece)
+            continue
+        tail.append(memoryview(piece)[sent:] if sent else piece)
+        sent = 0
+    return tail
+
+
+def _writer(esds):
+    # a chunk's ADTS writer, None when its audio can't be carried in ADTS
+    try:
+        return AdtsWriter.from_esds(esds)
+    except ValueError as e:
+        getLogger('Chunk').warning('_writer: %s, keeping frames bare', e)
+        return None
+
+
+def _piece(writer, frames):
+    # frames back to back, each with its ADTS header in front of it when
+    # there's a writer, and where each of them starts
+    header_size = 0 if writer is None else writer.HEADER_SIZE
+    audio = b''.join(frames) if writer is None else writer.write(frames)
+    offsets = array(
+        _UINT32,
+        accumulate((len(frame) + header_size for frame in frames), initial=0),
+    )
+    return audio, offsets
+
+
+def _join(pieces):
+    # pieces as a single one
+    offsets = array(_UINT32, (0,))
+    for _, piece_offsets in pieces:
+        base = offsets.pop()
+        offsets.extend(offset + base for offset in piece_offsets)
+    return b''.join(audio for audio, _ in pieces), offsets
+
+
+def _split(audio, offsets, header_size):
+    # the bare frames of a piece
+    audio = memoryview(audio)
+    return [
+        audio[offsets[i] + header_size : offsets[i + 1]]
+        for i in range(len(offsets) - 1)
+    ]
+
+
+# A segment. Once it's been framed all that's kept is its frames, ADTS headers
+# and all, back to back in a single buffer that goes out to listeners as is,
+# where each of them starts, and the bytes in front of them, ftyp, moov, moof,
+# and mdat's header. That's enough to give back the body and to parse for
+# esds, duration, and timing, the body itself and its box tree go, so a
+# buffered segment costs about the size of its audio.
+@dataclass(order=True, slots=True)
 class _Chunk:
     seq_num: int
     seen_at: int = field(compare=False)
+    # the raw body, only until it's been framed
     content: bytes = field(compare=False)
+    # the most recent seq_num upstream had when it served us this one
+    head_seq_num: int = field(compare=False, default=None)
+    _header: bytes = field(compare=False, default=None)
+    _audio: bytes = field(compare=False, default=None)
+    _offsets: array = field(compare=False, default=None)
+    # in front of each frame in _audio, 0 when they can't be carried in ADTS
+    # and are kept bare
+    _header_size: int = field(compare=False, default=AdtsWriter.HEADER_SIZE)
+    _mp4: Mp4 = field(compare=False, default=None)
+
+    def __post_init__(self):
+        start = perf_counter()
+        mp4 = Mp4(self.content)
+        writer = _writer(mp4.esds)
+        if writer is None:
+            self._header_size = 0
+        self._frame(self.content, *_piece(writer, list(mp4.frames)))
+        MP4_PARSE.observe(perf_counter() - start)
+
+    def _frame(self, content, audio, offsets):
+        self._audio = audio
+        self._offsets = offsets
+        bare = b''.join(self._framed()) if self._header_size else audio
+        if content.endswith(bare):
+            self._header = content[: len(content) - len(bare)]
+            self.content = None
+        else:
+            # the frames aren't the tail of the body, e.g. something trails
+            # the mdat, so hang on to the body as is
+            self.content = content
+
+    def _framed(self, start=0):
+        return _split(*self._rest(start), self._header_size)
+
+    def _rest(self, start=0):
+        # a view over the frames from start on, and where each of them starts
+        # in it
+        offsets = self._offsets
+        base = offsets[start]
+        if base:
+            offsets = array(_UINT32, (o - base for o in offsets[start:]))
+        return memoryview(self._audio)[base:], offsets
+
+    def _body(self):
+        if self.content is not None:
+            return [self.content]
+        if self._header_size:
+            return [self._header, b''.join(self._framed())]
+        return [self._header, self._audio]
 
     @property
     def mp4(self):
-        if not hasattr(self, '_mp4'):
-            self._mp4 = Mp4(self.content)
+        # everything in front of the frames, moov and moof are there for
+        # time, duration, and esds
+        if self._mp4 is None:
+            self._mp4 = Mp4(
+                self._header if self.content is None else self.content
+            )
         return self._mp4
 
+    @property
+    def esds(self):
+        return self.mp4.esds
+
+    @property
+    def size(self):
+        if self.content is not None:
+            return len(self.content)
+        frames = len(self._offsets) - 1
+        return len(self._header) + len(self._audio) - frames * self._header_size
+
+    def _batches(self):
+        # (audio, offsets) pieces as they're available, all at once for us
+        yield self._rest()
+
+    async def _abatches(self):
+        yield self._rest()
+
+    def batches(self):
+        # bare frames in batches as they're available
+        for audio, offsets in self._batches():
+            yield _split(audio, offsets, self._header_size)
+
+    async def abatches(self):
+        async for audio, offsets in self._abatches():
+            yield _split(audio, offsets, self._header_size)
+
+    def adts(self):
+        # as batches, but each is a view over the frames with their ADTS
+        # headers, ready to go, and where each of them starts in it
+        for piece in self._batches():
+            self._check_adts()
+            yield piece
+
+    async def aadts(self):
+        async for piece in self._abatches():
+            self._check_adts()
+            yield piece
+
+    def _check_adts(self):
+        if not self._header_size:
+            raise ValueError(f'{self!r} cannot be carried in ADTS')
+
+    def data(self):
+        # the raw body as it's available, all at once for us
+        yield from self._body()
+
+    def __repr__(self):
+        return f'Chunk(seq_num={self.seq_num}, seen_at={self.seen_at}, content=***, frames={len(self._offsets) - 1})'
+
+
+@dataclass(order=True, repr=False, slots=True)
+class _StreamingChunk(_Chunk):
+    # a chunk whose body is still downloading, it's handed out as soon as the
+    # headers arrive and consumers get frames as they land, ADTS headers and
+    # all. it's framed once it's complete
+    complete: bool = field(compare=False, default=False)
+    _parser: Mp4Parser = field(compare=False, default=None)
+    _parse_time: float = field(compare=False, default=0)
+    _writer: AdtsWriter = field(compare=False, default=None)
+    _cond: Condition = field(compare=False, default=None)
+    _async: AsyncWaiters = field(compare=False, default=None)
+    # (audio, offsets) pieces and raw body as they arrive, until it's complete
+    _pieces: list = field(compare=False, default=None)
+    _raw: list = field(compare=False, default=None)
+    _resp: object = field(compare=False, default=None)
+
+    def __post_init__(self):
+        self._parser = Mp4Parser()
+        self._cond = Condition()
+        self._async = AsyncWaiters()
+        self._pieces = []
+        self._raw = []
+
+    def feed(self, data):
+        start = perf_counter()
+        frames = self._parser.feed(data)
+        piece = None
+        if frames:
+            if self._writer is None and self._header_size:
+                # moov's landed by the time there are frames
+                self._writer = _writer(self._parser.mp4.esds)
+                if self._writer is None:
+                    self._header_size = 0
+            piece = _piece(self._writer, frames)
+        self._parse_time += perf_counter() - start
+        with self._cond:
+            self._raw.append(data)
+            if piece is not None:
+                self._pieces.append(piece)
+            self._cond.notify_all()
+            self._async.notify()
+
+    def finish(self):
+        with self._cond:
+            self._frame(b''.join(self._raw), *_join(self._pieces))
+            self._pieces = self._raw = None
+            self.complete = True
+            self._parser = self._writer = None
+            self._cond.notify_all()
+            self._async.notify()
+        MP4_PARSE.observe(self._parse_time)
+
+    @property
+    def mp4(self):
+        parser = self._parser
+        if parser is not None:
+            # no mdat, the frames come out of batches, but moov and moof are
+            # there for time, duration, and esds
+            return parser.mp4
+        return _Chunk.mp4.fget(self)
+
+    @property
+    def esds(self):
+        # moov comes ahead of the first samples, don't go looking for it
+        # before it's landed or we'd fall back to the defaults for good
+        with self._cond:
+            self._cond.wait_for(lambda: self.complete or self._pieces)
+        return self.mp4.esds
+
+    @property
+    def size(self):
+        # what's arrived so far
+        parser = self._parser
+        if parser is not None:
+            return parser.size
+        return _Chunk.size.fget(self)
+
+    def _pending(self, p, i):
+        # pieces from p on, or once it's complete, what's left from frame i
+        # on, called with _cond held
+        if self.complete:
+            if i < len(self._offsets) - 1:
+                return [self._rest(i)]
+            return []
+        return [
+            (memoryview(audio), offsets) for audio, offsets in self._pieces[p:]
+        ]
+
+    def _batches(self):
+        p = i = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self.complete or p < len(self._pieces)
+                )
+                pieces = self._pending(p, i)
+            if not pieces:
+                return
+            for piece in pieces:
+                p += 1
+                i += len(piece[1]) - 1
+                yield piece
+
+    async def _abatches(self):
+        p = i = 0
+        while True:
+            await self._async.wait_for(
+                self._cond, lambda: self.complete or p < len(self._pieces)
+            )
+            with self._cond:
+                pieces = self._pending(p, i)
+            if not pieces:
+                return
+            for piece in pieces:
+                p += 1
+                i += len(piece[1]) - 1
+                yield piece
+
+    def data(self):
+        i = 0
+        sent = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.complete or i < len(self._raw))
+                if self.complete:
+                    # whatever's left now that it's been framed
+                    new = _tail(self._body(), sent)
+                else:
+                    new = self._raw[i:]
+            if not new:
+                return
+            i += len(new)
+            for data in new:
+                sent += len(data)
+                yield data
+
+    def __repr__(self):
+        return f'StreamingChunk(seq_num={self.seq_num}, seen_at={self.seen_at}, complete={self.complete})'
+
+
+@dataclass
+class _Resolved:
+    url: str
+    itag: int
+    expires_at: float
+    live: bool = True
+    size: int = None
+    mime_type: str = 'audio/mp4'
+    # time() it was last handed out
+    last_used: float = None
+
     def __repr__(self):
-        mp4 = getattr(self, '_mp4', None) is not None
-        return f'Chunk(seq_num={self.seq_num}, seen_at={self.seen_at}, content=***, mp4={mp4})'
+        return f'Resolved(itag={self.itag}, expires_at={self.expires_at}, live={self.live}, size={self.size}, last_used={self.last_used}, url=***)'
+
+
+# Caches the best audio stream's url & itag per video id so that repeat plays
+# don't have to go through pytube. Entries live until the url's expire and
+# ones that have been used in the last idle_after seconds get re-resolved in
+# the background shortly before then, by a single thread for all of them.
+class StreamResolver:
+
+    log = getLogger('StreamResolver')
+
+    def __init__(
+        self, refresh_before=300, default_ttl=1800, idle_after=600, retry=60
+    ):
+        self.refresh_before = refresh_before
+        self.default_ttl = default_ttl
+        self.idle_after = idle_after
+        # how long to wait before trying a failed refresh again
+        self.retry = retry
+
+        self._lock = Lock()
+        self._cond = Condition(self._lock)
+        self._resolved = {}
+        # time() each vid's next due a refresh
+        self._refresh_at = {}
+        self._scheduler = None
+
+    def _expires_at(self, url):
+        try:
+            return float(parse_qs(urlparse(url).query)['expire'][0])
+        except (KeyError, ValueError):
+            self.log.warning('_expires_at: no expire in url, using default_ttl')
+            return time() + self.default_ttl
+
+    def _resolve(self, youtube):
+        best = youtube.best_audio_stream()
+        live = youtube.is_live
+        resolved = _Resolved(
+            url=best.url,
+            itag=best.itag,
+            expires_at=self._expires_at(best.url),
+            live=live,
+            # live streams don't have one, for anything else it's what range
+            # requests are worked out against
+            size=None if live else best.filesize,
+            mime_type=getattr(best, 'mime_type', 'audio/mp4'),
+        )
+        self.log.info('_resolve: vid=%s, resolved=%s', youtube.id, resolved)
+
+        with self._lock:
+            self._resolved[youtube.id] = resolved
+            self._schedule(
+                youtube.id, resolved.expires_at - self.refresh_before
+            )
+
+        return resolved
+
+    def _schedule(self, vid, when):
+        # called with _lock held
+        self._refresh_at[vid] = when
+        if self._scheduler is None:
+            self._scheduler = Thread(
+                target=self._run, name='StreamResolver.scheduler', daemon=True
+            )
+            self._scheduler.start()
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time()
+                due = [
+                    (vid, self._resolved.get(vid))
+                    for vid, when in self._refresh_at.items()
+                    if when <= now
+                ]
+                if not due:
+                    # until the next one's due, or something new's scheduled
+                    self._cond.wait(
+                        min(self._refresh_at.values()) - now
+                        if self._refresh_at
+                        else None
+                    )
+                    continue
+                for vid, _ in due:
+                    del self._refresh_at[vid]
+            for vid, resolved in due:
+                if resolved is not None:
+                    self._refresh(vid, resolved)
+
+    def _refresh(self, vid, resolved):
+        with self._lock:
+            if self._resolved.get(vid) is not resolved:
+                # already replaced
+                return
+            last_used = resolved.last_used
+            if last_used is None or time() - last_used > self.idle_after:
+                self.log.info('_refresh: vid=%s unused, dropping', vid)
+                del self._resolved[vid]
+                return
+        self.log.info('_refresh: vid=%s', vid)
+        try:
+            self._resolve(YouTube(vid))
+        except Exception:
+            self.log.exception('_refresh: vid=%s failed', vid)
+            with self._lock:
+                if self._resolved.get(vid) is resolved:
+                    self._schedule(vid, time() + self.retry)
+
+    def resolve(self, youtube):
+        with self._lock:
+            resolved = self._resolved.get(youtube.id)
+        if resolved is None or resolved.expires_at <= time():
+            resolved = self._resolve(youtube)
+        resolved.last_used = time()
+        return resolved
+
+    def invalidate(self, vid):
+        with self._lock:
+            self._resolved.pop(vid, None)
+            self._refresh_at.pop(vid, None)
 
 
 class YouTubeStreamer(Thread):
-    def __init__(self, youtube, duration=5.0):
+    # what googlevideo gives us when asking for a sq that isn't out yet
+    NOT_READY_STATUSES = (204, 404)
+    # FETCHES results it counts
+    RESULTS = ('new', 'duplicate', 'not_ready', 'error')
+
+    def __init__(
+        self,
+        youtube,
+        duration=5.0,
+        queue=None,
+        resolver=None,
+        retries=3,
+        hedge_after=None,
+        max_failures=5,
+        incremental=True,
+        max_not_ready=3,
+    ):
         name = f'YouTubeStreamer[{youtube.id}]'
         super().__init__(name=name)
         self.log = getLogger(name)
@@ -41,69 +503,335 @@ class YouTubeStreamer(Thread):
         self.youtube = youtube
         self.duration = duration
         self.searching_wait = duration / 4
+        self.resolver = resolver
+        # consecutive failed fetches, after retries, before we give up
+        self.max_failures = max_failures
+        # segment durations to keep asking for one that isn't out before
+        # checking the head, it's been skipped or the broadcast is over
+        self.max_not_ready = max_not_ready
+        # hand out segments as they download rather than once they're done
+        self.incremental = incremental
 
         self.running = False
-        self.queue = Queue()
-
-        sess = Session()
-        sess.headers = {
-            'accept-language': 'en-US,en',
-            'content-type': 'application/json',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.87 Safari/537.36',
-        }
-        self._sess = sess
+        self._stopped = Event()
+        self.started_at = None
+        # last time we handed out a chunk, used to reap stuck streamers
+        self.last_active = None
+        # anything with Queue's put/qsize/empty/get, e.g. a Broadcaster
+        self.queue = Queue() if queue is None else queue
+
+        self._fetcher = HedgedFetcher(
+            youtube.id,
+            timeout=duration / 2.0,
+            retries=retries,
+            hedge_after=hedge_after,
+            cancelled=self._stopped,
+        )
+        self._failures = 0
 
     def start(self):
         self.log.info('start: ')
         self.running = True
+        self.started_at = self.last_active = time()
+        streamers.add(self)
         super().start()
 
-    def stop(self):
-        self.log.info('stop: emptying queue')
+    def stop(self, join=False, timeout=None):
+        # flag it and wake run up from any wait, whatever is consuming the
+        # queue owns what's in it
+        self.log.info('stop: join=%s', join)
         self.running = False
-        while not self.queue.empty():
-            self.queue.get(block=False)
+        self._stopped.set()
+        if join and self.is_alive() and self is not current_thread():
+            # at most an in-flight request's worth
+            self.join(self.duration if timeout is None else timeout)
+            if self.is_alive():
+                self.log.warning('stop: still running after join')
+
+    def _sleep(self, wait, seq_num=None):
+        # a sleep that stop cuts short
+        start = monotonic()
+        self._stopped.wait(wait)
+        tracer.record(self.youtube.id, WAIT, start, seq_num=seq_num)
+
+    def _response_chunk(self, resp):
+        head_seq_num = resp.headers.get('x-head-seqnum')
+        start = monotonic()
+        with tracer.profiled():
+            chunk = _Chunk(
+                seq_num=int(resp.headers['x-sequence-num']),
+                seen_at=int(resp.headers['x-walltime-ms']) / 1000.0,
+                content=resp.content,
+                head_seq_num=(
+                    None if head_seq_num is None else int(head_seq_num)
+                ),
+            )
+        tracer.record(
+            self.youtube.id, PARSE, start, chunk.seq_num, chunk.seen_at
+        )
+        return chunk
+
+    def _get(self, url, stream=False, seq_num=None):
+        # retries & hedging all need to fit inside of a segment's duration
+        start = time()
+        traced = monotonic()
+        with tracer.profiled():
+            resp = self._fetcher.get(
+                url, deadline=start + self.duration, stream=stream
+            )
+        FETCH_LATENCY.observe(time() - start, vid=self.youtube.id)
+        walltime = resp.headers.get('x-walltime-ms')
+        tracer.record(
+            self.youtube.id,
+            FETCH,
+            traced,
+            seq_num=seq_num,
+            walltime=None if walltime is None else int(walltime) / 1000.0,
+        )
+        if resp.status_code == 403:
+            # most likely the url has expired or been revoked, have it
+            # re-resolved next time around, from scratch rather than out of
+            # what pytube already fetched, which would hand it right back
+            self.log.warning('_get: forbidden, invalidating url')
+            self.youtube.reset()
+            if self.resolver:
+                self.resolver.invalidate(self.youtube.id)
+        return resp
+
+    def _failed(self, e):
+        FETCHES.inc(vid=self.youtube.id, result='error')
+        self._failures += 1
+        if self._failures > self.max_failures:
+            self.log.error('run: giving up after %d failures', self._failures)
+            raise e
+        self.log.warning(
+            'run: fetch failed, failures=%d, e=%s', self._failures, e
+        )
 
     def fetch(self, url):
-        resp = self._sess.get(url, timeout=self.duration / 2.0)
-        # TODO: retries?
+        resp = self._get(url)
         resp.raise_for_status()
-        return _Chunk(
+        return self._response_chunk(resp)
+
+    def fetch_seq(self, url, seq_num):
+        # ask for a specific segment, returns None if it hasn't been published
+        # yet
+        resp = self._get(
+            f'{url}&sq={seq_num}', stream=self.incremental, seq_num=seq_num
+        )
+        if (
+            resp.status_code in self.NOT_READY_STATUSES
+            or resp.headers.get('content-length') == '0'
+            or (not self.incremental and not resp.content)
+        ):
+            self.log.debug(
+                'fetch_seq: seq_num=%d not ready, status=%d',
+                seq_num,
+                resp.status_code,
+            )
+            resp.close()
+            return None
+        resp.raise_for_status()
+        if not self.incremental:
+            return self._response_chunk(resp)
+
+        head_seq_num = resp.headers.get('x-head-seqnum')
+        chunk = _StreamingChunk(
             seq_num=int(resp.headers['x-sequence-num']),
             seen_at=int(resp.headers['x-walltime-ms']) / 1000.0,
-            content=resp.content,
+            content=None,
+            head_seq_num=None if head_seq_num is None else int(head_seq_num),
         )
+        chunk._resp = resp
+        return chunk
+
+    def _download(self, chunk):
+        # feed a streaming chunk its body, consumers pick up frames as they
+        # land
+        resp = chunk._resp
+        start = monotonic()
+        try:
+            with tracer.profiled():
+                for data in resp.iter_content(chunk_size=None):
+                    if not self.running:
+                        self.log.debug('_download: stopped')
+                        break
+                    chunk.feed(data)
+        except RequestException as e:
+            # consumers already have part of this segment, so we move on
+            # rather than re-fetching it
+            FETCHES.inc(vid=self.youtube.id, result='error')
+            self.log.warning('_download: chunk=%s, failed e=%s', chunk, e)
+        finally:
+            chunk._resp = None
+            resp.close()
+            chunk.finish()
+            vid = self.youtube.id
+            end = monotonic()
+            tracer.record(vid, DOWNLOAD, start, chunk.seq_num, chunk.seen_at)
+            # parsing happens bit by bit as the body lands, this is how much
+            # of the download it was
+            tracer.record(
+                vid,
+                PARSE,
+                end - chunk._parse_time,
+                chunk.seq_num,
+                chunk.seen_at,
+                end=end,
+            )
+
+    def _duration(self, chunk):
+        try:
+            return chunk.mp4.duration or self.duration
+        except StopIteration:
+            # a partial download that never got as far as its moof
+            return self.duration
+
+    def url(self):
+        if self.resolver:
+            # picks up background refreshes of the url
+            return self.resolver.resolve(self.youtube).url
+        return self.youtube.best_audio_stream().url
+
+    def _put(self, chunk):
+        self.last_active = time()
+        self.queue.put(chunk)
+        QUEUE_DEPTH.set(self.queue.qsize(), vid=self.youtube.id)
 
     def run(self):
+        ACTIVE_STREAMERS.inc()
+        try:
+            self._run()
+        finally:
+            if streamers.remove(self):
+                # the series are per video, leave them be if there's already
+                # a replacement going
+                vid = self.youtube.id
+                QUEUE_DEPTH.remove(vid=vid)
+                FETCH_LATENCY.remove(vid=vid)
+                for result in self.RESULTS:
+                    FETCHES.remove(vid=vid, result=result)
+            ACTIVE_STREAMERS.dec()
+            # let whoever is consuming know there's nothing more coming
+            self.queue.put(None)
+
+    def _run(self):
         self.log.info('run: ')
-        self.running = True
 
-        audio = list(
-            self.youtube.streams.filter(adaptive=True, only_audio=True)
-        )
-        audio.sort(key=lambda s: int(s.abr.replace('kbps', '')), reverse=True)
-        best = audio[0]
-        url = best.url
+        url = self.url()
         self.log.debug('run: url=%s', url)
 
-        # grab our first chunk
+        # grab our first chunk, whatever is currently the head
         chunk = self.fetch(url)
         self.log.debug('run: first chunk=%s', chunk)
-        self.queue.put(chunk)
+        FETCHES.inc(vid=self.youtube.id, result='new')
+        self._put(chunk)
+
+        if chunk.head_seq_num is None:
+            self.log.info('run: no head seqnum, polling for new chunks')
+            self._poll(chunk)
+        else:
+            self._follow(chunk)
+
+        self.log.info('run: exiting')
+
+    def _follow(self, chunk):
+        # ask for each segment by sequence number, scheduled off of the
+        # upstream's wall clock, so that we make ~1 request per segment and
+        # pick them up as soon as they're published
+        head_seq_num = chunk.head_seq_num
+        # local time minus upstream wall time, smallest seen is our best
+        # estimate of the skew + latency between us
+        offset = time() - chunk.seen_at
+        not_ready_wait = self.duration / 20
+        # when we started getting not ready for the current seq_num
+        not_ready_since = None
 
-        wait = self.searching_wait
         while self.running:
-            if self.queue.qsize() > 2:
-                self.log.info('run: assuming consumer is gone')
-                self.stop()
+            seq_num = chunk.seq_num + 1
+            if seq_num > head_seq_num:
+                # not published yet, it should show up a segment's duration
+                # after the one we have
+                due = chunk.seen_at + self._duration(chunk) + offset
+                wait = due - time()
+                if wait > 0:
+                    self.log.debug('run: seq_num=%d, waiting=%f', seq_num, wait)
+                    self._sleep(wait, seq_num)
+
+            start = time()
+            try:
+                candidate = self.fetch_seq(self.url(), seq_num)
+            except RequestException as e:
+                self._failed(e)
+                self._sleep(not_ready_wait)
                 continue
+            self._failures = 0
+            elapsed = time() - start
+            self.log.debug(
+                'run:   seq_num=%d, candidate chunk=%s, elapsed=%f',
+                seq_num,
+                candidate,
+                elapsed,
+            )
+            if candidate is None:
+                FETCHES.inc(vid=self.youtube.id, result='not_ready')
+                now = time()
+                if not_ready_since is None:
+                    not_ready_since = now
+                if now - not_ready_since <= self.max_not_ready * self.duration:
+                    # we're a bit early
+                    self._sleep(not_ready_wait, seq_num)
+                    continue
+                # it's been skipped or the broadcast is over, see where the
+                # head is
+                self.log.warning(
+                    'run: seq_num=%d not ready for %f, checking head',
+                    seq_num,
+                    now - not_ready_since,
+                )
+                try:
+                    candidate = self.fetch(self.url())
+                except RequestException as e:
+                    self._failed(e)
+                    self._sleep(not_ready_wait)
+                    continue
+                if candidate.seq_num <= chunk.seq_num:
+                    self.log.info(
+                        'run: head still seq_num=%d, stream has ended',
+                        candidate.seq_num,
+                    )
+                    return
+                self.log.info(
+                    'run: skipping to head seq_num=%d', candidate.seq_num
+                )
+            not_ready_since = None
+
+            FETCHES.inc(vid=self.youtube.id, result='new')
+            if candidate.head_seq_num is not None:
+                head_seq_num = max(head_seq_num, candidate.head_seq_num)
+            offset = min(offset, time() - candidate.seen_at)
+            self._put(candidate)
+            if isinstance(candidate, _StreamingChunk):
+                # fetch_seq hands it out still downloading, fetch whole
+                self._download(candidate)
+            chunk = candidate
+
+    def _poll(self, chunk):
+        wait = self.searching_wait
+        while self.running:
             if wait > 0:
                 self.log.debug('run: waiting=%f', wait)
-                sleep(wait)
+                self._sleep(wait)
 
             # fetch a new candidate
             start = time()
-            candidate = self.fetch(url)
+            try:
+                candidate = self.fetch(self.url())
+            except RequestException as e:
+                self._failed(e)
+                wait = self.searching_wait
+                continue
+            self._failures = 0
             elapsed = time() - start
             self.log.debug(
                 'run:   candidate chunk=%s, elapsed=%f', candidate, elapsed
@@ -112,150 +840,162 @@ class YouTubeStreamer(Thread):
             seq_diff = candidate.seq_num - chunk.seq_num
             if seq_diff > 0:
                 self.log.debug('run:   new chunk')
+                FETCHES.inc(vid=self.youtube.id, result='new')
                 # we were searching, and we're done
                 # we should be at most searching_wait after a change, next
                 # one should come before duration
-                wait = candidate.mp4.duration
+                wait = self._duration(candidate)
                 # make it our new chunk and add it to the set
                 chunk = candidate
-                self.queue.put(chunk)
+                self._put(chunk)
             else:
                 self.log.debug('run:   duplicate chunk')
+                FETCHES.inc(vid=self.youtube.id, result='duplicate')
                 # we're off track, go back to searching
                 wait = self.searching_wait
 
             wait -= elapsed
 
-        self.log.info('run: exiting')
-
 
-class YouTube(_YouTube):
-    PRE_SERVE = 0.5
-    RE_FETCH_DELAY = 1.0
+# Every live YouTubeStreamer thread, so that they can be inspected and any
+# that have stopped producing reaped
+class StreamerRegistry:
+    log = getLogger('StreamerRegistry')
+
+    def __init__(self):
+        self._lock = Lock()
+        self._streamers = set()
+        self._reaper = None
+
+    def add(self, streamer):
+        with self._lock:
+            self._streamers.add(streamer)
+
+    def remove(self, streamer):
+        # returns whether that was the last one for its video
+        vid = streamer.youtube.id
+        with self._lock:
+            self._streamers.discard(streamer)
+            return not any(s.youtube.id == vid for s in self._streamers)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._streamers))
+
+    def __len__(self):
+        return len(self._streamers)
+
+    def describe(self):
+        now = time()
+        return [
+            {
+                'name': s.name,
+                'vid': s.youtube.id,
+                'alive': s.is_alive(),
+                'running': s.running,
+                'age': now - s.started_at,
+                'idle': now - s.last_active,
+                'queue_depth': s.queue.qsize(),
+            }
+            for s in self
+        ]
+
+    def reap(self, idle_after):
+        now = time()
+        reaped = 0
+        for streamer in self:
+            if now - streamer.last_active > idle_after:
+                self.log.warning(
+                    'reap: %s idle for %f, stopping',
+                    streamer.name,
+                    now - streamer.last_active,
+                )
+                streamer.stop(join=True)
+                reaped += 1
+        return reaped
+
+    def start_reaper(self, interval=30.0, idle_after=120.0):
+        def reaper():
+            while True:
+                sleep(interval)
+                try:
+                    self.reap(idle_after)
+                except Exception:
+                    self.log.exception('reaper: failed')
+
+        with self._lock:
+            if self._reaper is None:
+                self.log.info(
+                    'start_reaper: interval=%f, idle_after=%f',
+                    interval,
+                    idle_after,
+                )
+                self._reaper = Thread(
+                    target=reaper, name='StreamerRegistry.reaper', daemon=True
+                )
+                self._reaper.start()
 
-    def __init__(self, id):
-        self.log = getLogger(f'YouTube[{id}]')
-        self.log.info('__init__:')
 
-        self.id = id
+streamers = StreamerRegistry()
 
-        # annoying there's not a session on the _YouTube object
-        sess = Session()
-        sess.headers = {
-            'accept-language': 'en-US,en',
-            'content-type': 'application/json',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.87 Safari/537.36',
-        }
-        self._sess = sess
-
-        super().__init__(f'https://youtu.be/{id}')
-
-    def check_availability(self):
-        # parent class blows up b/c of live stream, that's what we're expecting
-        # here ...
-        pass
-
-    # TODO: timeout based on duration
-    def fetch(self, url, timeout=2.5):
-        resp = self._sess.get(url, timeout=timeout)
-        resp.raise_for_status()
-        return Mp4(resp.content)
 
-    # https://docs.fileformat.com/video/mp4/#:~:text=Here%20is%20a%20list%20of%20second%2Dlevel%20atoms%20used%20in,the%20user%20and%20track%20information.
-    def stream_best_audio_mp4(self):
-        self.log.debug('stream_best_audio_mp4: ')
+_pytube_lock = Lock()
+_PyTube = None
 
-        audio = list(self.streams.filter(adaptive=True, only_audio=True))
-        audio.sort(key=lambda s: int(s.abr.replace('kbps', '')), reverse=True)
-        best = audio[0]
-        url = best.url
 
-        # TODO: exit when we no longer have a client
-        clock = None
-        while True:
-            start = time()
-            self.log.debug('stream_best_audio_mp4: request start=%f', start)
+def _pytube():
+    # pytube is a sizable import and only needed once something has to be
+    # resolved, e.g. not for health checks or anything already warm
+    global _PyTube
+    with _pytube_lock:
+        if _PyTube is None:
+            from pytube import YouTube as _YouTube
 
-            mp4 = self.fetch(url)
-            while mp4.time == clock:
-                self.log.info(
-                    'stream_best_audio_mp4:   early fetch, redoing after delay=%f',
-                    self.RE_FETCH_DELAY,
-                )
-                sleep(self.RE_FETCH_DELAY)
-                start = time()
-                mp4 = self.fetch(url)
+            class _PyTube(_YouTube):
+                def check_availability(self):
+                    # parent class blows up b/c of live stream, that's what
+                    # we're expecting here ...
+                    pass
 
-            elapsed = time() - start
-            self.log.debug('stream_best_audio_mp4:   elapsed=%f', elapsed)
-
-            # TODO: average elapsed
-            if clock is None:
-                # and wait half of the mp4's duration so we're playing it with a
-                # bit of breating room to get the next
-                pre_wait = mp4.duration * 0.75 - self.PRE_SERVE
-                post_wait = 0
-            else:
-                # we want to wait the time between mp4s with enough time to make
-                # the next request
-                pre_wait = mp4.time - clock - elapsed - self.PRE_SERVE
-                post_wait = self.PRE_SERVE
-            self.log.debug(
-                'stream_best_audio_mp4:   pre_wait=%f, post_wait=%f, total=%f',
-                pre_wait,
-                post_wait,
-                pre_wait + post_wait,
-            )
-            if pre_wait > 0:
-                sleep(pre_wait)
+            # pytube's own requests go through our pool
+            install_pytube()
+        return _PyTube
 
-            # hand out the mp4
-            self.log.debug('stream_best_audio_mp4:   yield')
-            yield mp4
 
-            if post_wait > 0:
-                sleep(post_wait)
+class YouTube:
+    def __init__(self, id):
+        self.log = getLogger(f'YouTube[{id}]')
+        self.log.info('__init__:')
 
-            self.log.debug('stream_best_audio_mp4:   done')
+        self.id = id
+        self._sess = get_session()
+        self._pytube = None
 
-            # set our clock to the time mp4 we just played
-            clock = mp4.time
+    @property
+    def pytube(self):
+        if self._pytube is None:
+            self._pytube = _pytube()(f'https://youtu.be/{self.id}')
+        return self._pytube
 
-        # assume 5s chunks
-        duration = 5
-        # we want the first chunk now
-        expected = time()
-        while True:
-            start = time()
-            self.log.debug('stream_best_audio_mp4: request start=%f', start)
-
-            resp = self._sess.get(url, stream=True, timeout=duration / 2)
-            resp.raise_for_status()
-            for chunk in resp.iter_content(chunk_size=None):
-                self.log.debug('stream_best_audio_mp4: chunk=%d', len(chunk))
-                if chunk:
-                    yield chunk
-                    with open(f'/tmp/chunk.{start}.mp4', 'wb') as fh:
-                        fh.write(chunk)
-
-            # how long did the request take
-            now = time()
-            elapsed = now - start
-            self.log.debug(
-                'stream_best_audio_mp4:   now=%f, elapsed=%f', now, elapsed
-            )
+    def reset(self):
+        # forget what pytube fetched, e.g. a url that's since been revoked
+        self._pytube = None
 
-            # we expect the next chunk a duration into the future
-            expected += duration
-            # how far are we from the point we expect we'll need another chunk
-            needed = expected - now
-            # adjust needed for the time the request is likely to take
-            needed -= elapsed + 1
-            self.log.debug(
-                'stream_best_audio_mp4:   expected=%f, needed=%f',
-                expected,
-                needed,
-            )
+    @property
+    def streams(self):
+        return self.pytube.streams
 
-            if needed > 0:
-                sleep(needed)
+    @property
+    def is_live(self):
+        # currently live, a finished live stream is a regular video now
+        details = self.pytube.vid_info.get('videoDetails', {})
+        return bool(details.get('isLive', False))
+
+    def best_audio_stream(self):
+        # mp4 if there's any, it's all live streams have and what everything
+        # downstream of us knows how to play
+        audio = list(
+            self.streams.filter(adaptive=True, only_audio=True, subtype='mp4')
+        ) or list(self.streams.filter(adaptive=True, only_audio=True))
+        audio.sort(key=lambda s: int(s.abr.replace('kbps', '')), reverse=True)
+        return audio[0]